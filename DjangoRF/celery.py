@@ -17,5 +17,13 @@ app.conf.beat_schedule = {
         'task': 'users.tasks.check_inactive_users',
         'schedule': crontab(hour=0, minute=0),  # Ежедневно в полночь (для тестирования)
     },
+    'send-course-update-digests': {
+        'task': 'materials.tasks.send_course_update_digests',
+        'schedule': crontab(minute='*/15'),  # Дайджесты по закрытым окнам изменений
+    },
+    'reconcile-stripe-payments': {
+        'task': 'materials.tasks.reconcile_stripe_payments',
+        'schedule': crontab(minute='*/10'),  # Сверка платежей с сессиями Stripe
+    },
 }
 
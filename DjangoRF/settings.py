@@ -137,15 +137,29 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
 }
 
+# Оценка количества строк по статистике планировщика PostgreSQL вместо COUNT(*)
+# для постраничной пагинации (на SQLite всегда точный подсчет)
+PAGINATION_ESTIMATED_COUNT = os.getenv('PAGINATION_ESTIMATED_COUNT', 'False').lower() == 'true'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # В access-токен встраиваются claims is_moderator и is_active
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.RoleTokenRefreshSerializer',
 }
 
+# Максимальный возраст claims, которым доверяют читающие эндпоинты без запроса к базе.
+# Claims пересчитываются при каждом обновлении токена, поэтому устаревают
+# не дольше, чем на время жизни access-токена
+JWT_ROLE_CLAIMS_MAX_AGE = timedelta(
+    seconds=int(os.getenv('JWT_ROLE_CLAIMS_MAX_AGE', SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()))
+)
+
 # URL-адрес брокера сообщений
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://redis:6379/0')
 
@@ -161,6 +175,19 @@ CELERY_TASK_TRACK_STARTED = True
 # Максимальное время на выполнение задачи
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
+# В тестах задачи выполняются синхронно, без брокера
+if 'test' in sys.argv or 'test_coverage' in sys.argv:
+    CELERY_TASK_ALWAYS_EAGER = True
+
+# Размер пачки подписчиков, которым письма отправляются через одно SMTP-соединение
+NOTIFICATION_CHUNK_SIZE = int(os.getenv('NOTIFICATION_CHUNK_SIZE', 500))
+
+# Длина окна, за которое изменения курсов собираются в один дайджест, в секундах
+NOTIFICATION_DIGEST_WINDOW = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', 4 * 60 * 60))
+
+# Сколько необработанных окон хранится на случай простоя celery beat
+NOTIFICATION_DIGEST_BACKLOG = int(os.getenv('NOTIFICATION_DIGEST_BACKLOG', 6))
+
 # Дополнительные настройки Celery
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -186,9 +213,9 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}',
+        # Опции передаются напрямую в redis-py (встроенный бэкенд Django, не django_redis)
         'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-            'PASSWORD': REDIS_PASSWORD if REDIS_PASSWORD else None,
+            'password': REDIS_PASSWORD if REDIS_PASSWORD else None,
         },
         'TIMEOUT': 300,
     }
@@ -196,3 +223,74 @@ CACHES = {
 
 CACHE_ENABLE = os.getenv('CACHE_ENABLE', 'True').lower() == 'true'
 
+# Время хранения закешированных ответов по курсам и урокам, в секундах
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+# Для тестов используем локальный кеш в памяти процесса.
+# Кеш ответов включается только в тестах, которые его проверяют
+if 'test' in sys.argv or 'test_coverage' in sys.argv:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+    CACHE_ENABLE = False
+
+# Время хранения роли пользователя (модератор или нет) в общем кеше, в секундах
+ROLE_CACHE_TIMEOUT = int(os.getenv('ROLE_CACHE_TIMEOUT', 300))
+
+# Время хранения пользователя в кеше аутентификации, в секундах
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 300))
+
+# Доля запросов, для которых учитываются попадания и промахи кеша аутентификации (0 - не учитывать)
+AUTH_CACHE_STATS_SAMPLE_RATE = float(os.getenv('AUTH_CACHE_STATS_SAMPLE_RATE', 0.01))
+
+# Размер пачки при блокировке неактивных пользователей
+INACTIVE_USERS_BATCH_SIZE = int(os.getenv('INACTIVE_USERS_BATCH_SIZE', 1000))
+
+# Время хранения соответствия (объект, сумма, валюта) -> цена Stripe в общем кеше, в секундах
+STRIPE_PRICE_CACHE_TIMEOUT = int(os.getenv('STRIPE_PRICE_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Создавать сессию оплаты с ценой в запросе (price_data): один вызов Stripe без продукта и цены
+STRIPE_INLINE_PRICE_DATA = os.getenv('STRIPE_INLINE_PRICE_DATA', 'False').lower() == 'true'
+
+# Таймауты соединения и чтения при обращении к Stripe, в секундах
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 3))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 10))
+
+# Число повторов запроса к Stripe (экспоненциальная задержка с jitter)
+STRIPE_MAX_NETWORK_RETRIES = int(os.getenv('STRIPE_MAX_NETWORK_RETRIES', 1))
+
+# Размер пула keep-alive соединений к Stripe
+STRIPE_POOL_SIZE = int(os.getenv('STRIPE_POOL_SIZE', 10))
+
+# Автомат защиты Stripe: сколько сбоев за окно (в секундах) размыкают его и на сколько секунд
+STRIPE_BREAKER_FAILURE_THRESHOLD = int(os.getenv('STRIPE_BREAKER_FAILURE_THRESHOLD', 5))
+STRIPE_BREAKER_WINDOW = int(os.getenv('STRIPE_BREAKER_WINDOW', 60))
+STRIPE_BREAKER_RESET_TIMEOUT = int(os.getenv('STRIPE_BREAKER_RESET_TIMEOUT', 30))
+
+# Адрес Stripe API. Для нагрузочных тестов можно указать сервер из команды fake_stripe
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')
+
+# Асинхронное создание платежа: ответ 202 сразу, сессия оплаты создается задачей Celery
+PAYMENT_ASYNC_CHECKOUT = os.getenv('PAYMENT_ASYNC_CHECKOUT', 'False').lower() == 'true'
+
+# Секрет подписи вебхуков Stripe
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+
+# Через сколько секунд без событий статус неоплаченной сессии запрашивается у Stripe напрямую
+PAYMENT_STATUS_STALE_AFTER = int(os.getenv('PAYMENT_STATUS_STALE_AFTER', 5 * 60))
+
+# Сверка платежей с Stripe: размер страницы списка сессий (не больше 100)
+# и глубина первой сверки в секундах
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.getenv('PAYMENT_RECONCILE_BATCH_SIZE', 100))
+PAYMENT_RECONCILE_LOOKBACK = int(os.getenv('PAYMENT_RECONCILE_LOOKBACK', 24 * 60 * 60))
+
+# Время хранения ответа по ключу идемпотентности и блокировки на время выполнения запроса, в секундах.
+# Для создания платежа блокировка не короче наибольшей длительности запросов к Stripe с повторами
+IDEMPOTENCY_KEY_TIMEOUT = int(os.getenv('IDEMPOTENCY_KEY_TIMEOUT', 24 * 60 * 60))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+# Максимальное число уроков в одном запросе массового создания или изменения
+LESSON_BULK_MAX_SIZE = int(os.getenv('LESSON_BULK_MAX_SIZE', 500))
+
+# Количество платежей, читаемых из базы за раз при выгрузке в CSV
+PAYMENT_EXPORT_CHUNK_SIZE = int(os.getenv('PAYMENT_EXPORT_CHUNK_SIZE', 2000))
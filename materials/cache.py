@@ -0,0 +1,145 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from users.roles import is_moderator
+
+# Версии групп данных. Ключ ответа включает текущие версии,
+# поэтому увеличение версии делает недействительными все зависимые ответы
+COURSES_VERSION = 'courses'
+LESSONS_VERSION = 'lessons'
+
+
+def subscriptions_version(user_id):
+    return f'subscriptions:{user_id}'
+
+
+def _version_key(name):
+    return f'materials:cache:version:{name}'
+
+
+def get_versions(names):
+    """
+    Текущие версии групп данных одним запросом к кешу
+    """
+    values = cache.get_many([_version_key(name) for name in names])
+    return [values.get(_version_key(name), 0) for name in names]
+
+
+def bump_versions(*names):
+    """
+    Увеличивает версии групп данных, сбрасывая закешированные ответы
+    """
+    for name in names:
+        key = _version_key(name)
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Ключ успел истечь между add и incr
+                cache.set(key, 1, timeout=None)
+
+
+def set_validator_headers(response, etag, last_modified):
+    """
+    Проставляет ETag и Last-Modified (timestamp) в ответ
+    """
+    if etag:
+        response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # Содержимое зависит от пользователя
+    patch_vary_headers(response, ['Authorization'])
+
+
+class CachedResponseMixin:
+    """
+    Read-through кеш ответов для читающих действий.
+    Ключ зависит от области видимости пользователя (модератор или владелец),
+    версий данных и полного адреса запроса.
+    Отключается настройкой CACHE_ENABLE
+    """
+    cache_resource = None
+    # Ответ содержит данные конкретного пользователя (например, is_subscribed)
+    cache_per_user = False
+
+    def get_cache_versions(self):
+        raise NotImplementedError
+
+    def get_cache_scope(self):
+        user = self.request.user
+        if self.cache_per_user:
+            role = 'moderator' if is_moderator(user) else 'owner'
+            return f'{role}:{user.pk}'
+        if is_moderator(user):
+            return 'moderator'
+        return f'owner:{user.pk}'
+
+    def get_response_cache_key(self, request):
+        versions = '.'.join(str(version) for version in get_versions(self.get_cache_versions()))
+        location = hashlib.md5(
+            f'{request.get_host()}{request.get_full_path()}'.encode()
+        ).hexdigest()
+        return f'materials:response:{self.cache_resource}:{self.get_cache_scope()}:{versions}:{location}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.CACHE_ENABLE or not request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            # Вместе с данными хранятся ETag и Last-Modified, поэтому условный
+            # запрос к закешированному ответу тоже не обращается к базе
+            data, etag, last_modified = entry
+            response = None
+            if etag:
+                response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = Response(data)
+            set_validator_headers(response, etag, last_modified)
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            entry = (
+                response.data,
+                response.headers.get('ETag'),
+                parse_http_date_safe(response.headers.get('Last-Modified')),
+            )
+            cache.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы: ответ получает ETag и Last-Modified,
+    а если данные у клиента актуальны, возвращается 304 без сериализации
+    """
+
+    def get_conditional_validators(self, request, *args, **kwargs):
+        """
+        Возвращает пару (etag_source, last_modified) или None, если объект не найден
+        """
+        raise NotImplementedError
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        validators = self.get_conditional_validators(request, *args, **kwargs)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        etag_source, last_modified = validators
+        etag = quote_etag(hashlib.sha256(etag_source.encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            set_validator_headers(response, etag, timestamp)
+        return response
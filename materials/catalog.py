@@ -0,0 +1,241 @@
+import csv
+import json
+from collections import Counter
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from users.models import User
+
+from .cache import COURSES_VERSION, LESSONS_VERSION, bump_versions
+from .counters import adjust_counter
+from .models import Course, Lesson
+from .validators import validate_youtube_link
+
+# Строка каталога одинакова для NDJSON и CSV. Курс определяется естественным ключом
+# (название, email владельца), урок - ключом курса и своим названием
+CATALOG_FIELDS = ('kind', 'course', 'course_owner', 'lesson', 'description', 'preview', 'video_link', 'lesson_owner')
+COURSE = 'course'
+LESSON = 'lesson'
+FORMATS = ('ndjson', 'csv')
+# Сколько сообщений о пропущенных строках сохраняется для отчета
+MAX_REPORTED_ERRORS = 100
+
+
+def export_rows(chunk_size=2000):
+    """
+    Строки каталога: сначала все курсы, затем все уроки.
+    Чтение через iterator(), поэтому в памяти одновременно не больше chunk_size строк
+    """
+    courses = Course.objects.order_by('pk').values_list('title', 'owner__email', 'description', 'preview')
+    for title, owner_email, description, preview in courses.iterator(chunk_size=chunk_size):
+        yield {
+            'kind': COURSE,
+            'course': title,
+            'course_owner': owner_email or '',
+            'description': description or '',
+            'preview': preview or '',
+        }
+
+    lessons = Lesson.objects.order_by('pk').values_list(
+        'course__title', 'course__owner__email', 'title', 'description', 'preview', 'video_link', 'owner__email'
+    )
+    for course_title, course_owner, title, description, preview, video_link, owner_email in lessons.iterator(
+        chunk_size=chunk_size
+    ):
+        yield {
+            'kind': LESSON,
+            'course': course_title,
+            'course_owner': course_owner or '',
+            'lesson': title,
+            'description': description or '',
+            'preview': preview or '',
+            'video_link': video_link or '',
+            'lesson_owner': owner_email or '',
+        }
+
+
+def write_rows(rows, stream, fmt):
+    """
+    Записывает строки в поток по одной. Возвращает число записанных строк
+    """
+    written = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=CATALOG_FIELDS, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+            written += 1
+    return written
+
+
+def read_rows(stream, fmt):
+    """
+    Читает строки из потока по одной. Пустые строки NDJSON пропускаются
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+class CatalogImport:
+    """
+    Импорт каталога пачками: для каждой пачки владельцы, курсы и уроки
+    ищутся одним запросом, новые записи создаются bulk_create, измененные - bulk_update.
+    Счетчики уроков и кеш ответов обновляются явно, так как массовые операции не вызывают сигналы
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.stats = Counter()
+        self.errors = []
+
+    def run(self, rows):
+        rows = enumerate(rows, start=1)
+        while batch := list(islice(rows, self.batch_size)):
+            with transaction.atomic():
+                self.import_batch(batch)
+        changes = ('courses_created', 'courses_updated', 'lessons_created', 'lessons_updated')
+        if any(self.stats[key] for key in changes):
+            bump_versions(COURSES_VERSION, LESSONS_VERSION)
+        return self.stats
+
+    def skip(self, number, message):
+        self.stats['skipped'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'Строка {number}: {message}')
+
+    @staticmethod
+    def changed(instance, values):
+        # Пустые значения (None, '', файл без имени) считаются одинаковыми
+        return any((getattr(instance, field) or None) != value for field, value in values.items())
+
+    def import_batch(self, batch):
+        self.stats['rows'] += len(batch)
+        emails = set()
+        for _, row in batch:
+            emails.update(email for email in (row.get('course_owner'), row.get('lesson_owner')) if email)
+        users = dict(User.objects.filter(email__in=emails).values_list('email', 'pk'))
+
+        courses, lessons = [], []
+        for number, row in batch:
+            kind = row.get('kind')
+            if not row.get('course'):
+                self.skip(number, 'не указано название курса')
+            elif row.get('course_owner') and row['course_owner'] not in users:
+                self.skip(number, f'пользователь {row["course_owner"]} не найден')
+            elif kind == COURSE:
+                courses.append((number, row))
+            elif kind == LESSON:
+                lessons.append((number, row))
+            else:
+                self.skip(number, f'неизвестный тип строки {kind!r}')
+
+        # Курсы пачки сохраняются первыми: на них могут ссылаться уроки той же пачки
+        if courses:
+            self.import_courses(courses, users)
+        if lessons:
+            self.import_lessons(lessons, users)
+
+    @staticmethod
+    def course_key(row, users):
+        return row['course'], users.get(row.get('course_owner'))
+
+    @staticmethod
+    def find_courses(keys):
+        # Из одноименных курсов одного владельца выбирается первый
+        found = {}
+        queryset = Course.objects.filter(title__in={title for title, _ in keys}).order_by('pk')
+        for course in queryset.only('id', 'title', 'owner_id', 'description', 'preview'):
+            key = (course.title, course.owner_id)
+            if key in keys:
+                found.setdefault(key, course)
+        return found
+
+    def import_courses(self, rows, users):
+        keys = {self.course_key(row, users) for _, row in rows}
+        existing = self.find_courses(keys)
+        now = timezone.now()
+        created, updated = {}, {}
+        for _, row in rows:
+            key = self.course_key(row, users)
+            values = {'description': row.get('description') or None, 'preview': row.get('preview') or None}
+            course = existing.get(key) or created.get(key)
+            if course is None:
+                created[key] = Course(title=key[0], owner_id=key[1], **values)
+            elif self.changed(course, values):
+                for field, value in values.items():
+                    setattr(course, field, value)
+                if course.pk:
+                    # bulk_update не заполняет auto_now
+                    course.updated_at = now
+                    updated[course.pk] = course
+
+        Course.objects.bulk_create(created.values(), batch_size=self.batch_size)
+        Course.objects.bulk_update(updated.values(), ['description', 'preview', 'updated_at'])
+        self.stats['courses_created'] += len(created)
+        self.stats['courses_updated'] += len(updated)
+
+    def import_lessons(self, rows, users):
+        courses = self.find_courses({self.course_key(row, users) for _, row in rows})
+        valid = []
+        for number, row in rows:
+            if not row.get('lesson'):
+                self.skip(number, 'не указано название урока')
+            elif self.course_key(row, users) not in courses:
+                self.skip(number, f'курс {row["course"]!r} не найден')
+            elif row.get('lesson_owner') and row['lesson_owner'] not in users:
+                self.skip(number, f'пользователь {row["lesson_owner"]} не найден')
+            else:
+                try:
+                    validate_youtube_link(row.get('video_link'))
+                except ValidationError as e:
+                    self.skip(number, str(e.detail[0]))
+                else:
+                    valid.append(row)
+
+        course_ids = {course.pk for course in courses.values()}
+        existing = {}
+        queryset = Lesson.objects.filter(
+            course_id__in=course_ids, title__in={row['lesson'] for row in valid}
+        ).order_by('pk').only('id', 'title', 'course_id', 'owner_id', 'description', 'preview', 'video_link')
+        for lesson in queryset:
+            existing.setdefault((lesson.course_id, lesson.title), lesson)
+
+        now = timezone.now()
+        created, updated = {}, {}
+        for row in valid:
+            course_id = courses[self.course_key(row, users)].pk
+            key = (course_id, row['lesson'])
+            values = {
+                'description': row.get('description') or None,
+                'preview': row.get('preview') or None,
+                'video_link': row.get('video_link') or None,
+            }
+            # Пустой lesson_owner не снимает владельца с существующего урока
+            if row.get('lesson_owner'):
+                values['owner_id'] = users[row['lesson_owner']]
+            lesson = existing.get(key) or created.get(key)
+            if lesson is None:
+                created[key] = Lesson(title=key[1], course_id=course_id, **values)
+            elif self.changed(lesson, values):
+                for field, value in values.items():
+                    setattr(lesson, field, value)
+                if lesson.pk:
+                    lesson.updated_at = now
+                    updated[lesson.pk] = lesson
+
+        Lesson.objects.bulk_create(created.values(), batch_size=self.batch_size)
+        Lesson.objects.bulk_update(updated.values(), ['owner', 'description', 'preview', 'video_link', 'updated_at'])
+        adjust_counter('lessons_count', Counter(course_id for course_id, _ in created))
+        self.stats['lessons_created'] += len(created)
+        self.stats['lessons_updated'] += len(updated)
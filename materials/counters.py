@@ -0,0 +1,82 @@
+from collections import Counter
+
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .cache import COURSES_VERSION, bump_versions
+from .models import Course, Lesson, Payment, Subscription
+
+COUNTER_FIELDS = ('lessons_count', 'subscribers_count', 'purchases_count')
+
+
+def adjust_counter(field, deltas):
+    """
+    Атомарно изменяет счетчик курсов: deltas = {id курса: изменение}.
+    Курсы с одинаковым изменением обновляются одним UPDATE.
+    Меняются только столбцы счетчика: updated_at отражает правки самого курса,
+    а изменение счетчиков попадает в ETag через их суммы.
+    Счетчики входят в ответы по курсам, поэтому их кеш сбрасывается
+    """
+    by_delta = {}
+    for course_id, delta in deltas.items():
+        if course_id is not None and delta:
+            by_delta.setdefault(delta, []).append(course_id)
+    updated = 0
+    for delta, course_ids in by_delta.items():
+        # Разошедшийся счетчик не уходит ниже нуля: отрицательное значение нарушило бы CHECK
+        value = F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+        updated += Course.objects.filter(pk__in=course_ids).update(**{field: value})
+    if updated:
+        bump_versions(COURSES_VERSION)
+
+
+def record_purchases(payments):
+    """
+    Учитывает платежи, ставшие оплаченными (словари с полем course_id)
+    """
+    adjust_counter('purchases_count', Counter(payment['course_id'] for payment in payments))
+
+
+def _actual_counts(queryset, course_ids):
+    return dict(
+        queryset.filter(course_id__in=course_ids).order_by().values('course_id')
+        .annotate(total=Count('id')).values_list('course_id', 'total')
+    )
+
+
+def repair_counters(batch_size=500):
+    """
+    Пересчет счетчиков курсов пачками по id. Сохраняются только разошедшиеся значения.
+    Возвращает (число проверенных курсов, число исправленных)
+    """
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        courses = list(
+            Course.objects.filter(pk__gt=last_id).order_by('pk').only('id', *COUNTER_FIELDS)[:batch_size]
+        )
+        if not courses:
+            return checked, repaired
+        course_ids = [course.id for course in courses]
+        actual = {
+            'lessons_count': _actual_counts(Lesson.objects.all(), course_ids),
+            'subscribers_count': _actual_counts(Subscription.objects.all(), course_ids),
+            'purchases_count': _actual_counts(Payment.objects.filter(is_paid=True), course_ids),
+        }
+
+        drifted = []
+        for course in courses:
+            changed = False
+            for field in COUNTER_FIELDS:
+                value = actual[field].get(course.id, 0)
+                if getattr(course, field) != value:
+                    setattr(course, field, value)
+                    changed = True
+            if changed:
+                drifted.append(course)
+        if drifted:
+            Course.objects.bulk_update(drifted, COUNTER_FIELDS)
+
+        checked += len(courses)
+        repaired += len(drifted)
+        last_id = course_ids[-1]
@@ -0,0 +1,81 @@
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Изменения курсов копятся в окнах фиксированной длины. Курс попадает в окно
+# не более одного раза: cache.add атомарен (SET NX в Redis), поэтому
+# параллельные правки одного курса не создают повторных записей
+LAST_PROCESSED_KEY = 'materials:digest:last_window'
+# Блокировка чтения и сдвига LAST_PROCESSED_KEY: перекрывающиеся запуски beat не отправят окно дважды
+LOCK_KEY = 'materials:digest:lock'
+
+
+def current_window(now=None):
+    return int((now or time.time()) // settings.NOTIFICATION_DIGEST_WINDOW)
+
+
+def _window_ttl():
+    # Необработанное окно хранится несколько периодов на случай простоя beat
+    return settings.NOTIFICATION_DIGEST_WINDOW * settings.NOTIFICATION_DIGEST_BACKLOG
+
+
+def _key(window, suffix):
+    return f'materials:digest:{window}:{suffix}'
+
+
+def record_course_change(course_id, now=None):
+    """
+    Отмечает, что курс изменился в текущем окне.
+    Возвращает True, если это первое изменение курса в окне
+    """
+    window = current_window(now)
+    ttl = _window_ttl()
+    if not cache.add(_key(window, f'course:{course_id}'), 1, ttl):
+        return False
+
+    cache.add(_key(window, 'count'), 0, ttl)
+    slot = cache.incr(_key(window, 'count'))
+    cache.set(_key(window, f'slot:{slot}'), course_id, ttl)
+    return True
+
+
+def changed_courses(window):
+    """
+    Курсы, изменившиеся в окне
+    """
+    count = cache.get(_key(window, 'count')) or 0
+    if not count:
+        return set()
+    slots = cache.get_many([_key(window, f'slot:{slot}') for slot in range(1, count + 1)])
+    return set(slots.values())
+
+
+def pending_windows(now=None):
+    """
+    Закрытые окна, которые еще не обработаны
+    """
+    window = current_window(now)
+    last_processed = cache.get(LAST_PROCESSED_KEY)
+    if last_processed is None:
+        last_processed = window - settings.NOTIFICATION_DIGEST_BACKLOG
+    return list(range(max(last_processed + 1, window - settings.NOTIFICATION_DIGEST_BACKLOG), window))
+
+
+def mark_processed(window):
+    cache.set(LAST_PROCESSED_KEY, window, timeout=None)
+
+
+@contextmanager
+def processing_lock():
+    """
+    Отдает True, если блокировка взята, и False, если окна уже обрабатывает другой запуск.
+    Блокировка истекает через окно на случай падения процесса
+    """
+    acquired = cache.add(LOCK_KEY, 1, settings.NOTIFICATION_DIGEST_WINDOW)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(LOCK_KEY)
@@ -0,0 +1,225 @@
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Локальная замена Stripe API для нагрузочных и интеграционных тестов.
+# Реализует только вызовы, которые делает StripeService: создание продукта, цены
+# и сессии оплаты, получение и список сессий. Включается настройкой STRIPE_API_BASE
+
+SESSION_PATH = re.compile(r'^/v1/checkout/sessions/(?P<session_id>[\w-]+)$')
+COMPLETE_PATH = re.compile(r'^/_fake/checkout/sessions/(?P<session_id>[\w-]+)/complete$')
+
+
+def _new_id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+class FakeStripeState:
+    """
+    Объекты, созданные через поддельный API
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.products = {}
+        self.prices = {}
+        self.sessions = {}
+        # Ответы по Idempotency-Key, как в настоящем Stripe
+        self.idempotent_responses = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def create_product(self, params):
+        product = {
+            'id': _new_id('prod'),
+            'object': 'product',
+            'name': params.get('name', ''),
+            'description': params.get('description'),
+            'created': int(time.time()),
+        }
+        self.products[product['id']] = product
+        return product
+
+    def create_price(self, params):
+        price = {
+            'id': _new_id('price'),
+            'object': 'price',
+            'product': params.get('product'),
+            'unit_amount': int(params.get('unit_amount', 0)),
+            'currency': params.get('currency', 'rub'),
+        }
+        self.prices[price['id']] = price
+        return price
+
+    def create_session(self, params, base_url):
+        if 'line_items[0][price]' in params:
+            amount_total = self.prices.get(params['line_items[0][price]'], {}).get('unit_amount', 0)
+        else:
+            amount_total = int(params.get('line_items[0][price_data][unit_amount]', 0))
+        session_id = _new_id('cs_test')
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'created': int(time.time()),
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'amount_total': amount_total,
+            'currency': params.get('line_items[0][price_data][currency]', 'rub'),
+            'mode': params.get('mode', 'payment'),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'url': f'{base_url}/pay/{session_id}',
+            'metadata': {
+                key[len('metadata['):-1]: value
+                for key, value in params.items()
+                if key.startswith('metadata[')
+            },
+        }
+        self.sessions[session_id] = session
+        return session
+
+    def list_sessions(self, params):
+        sessions = sorted(
+            self.sessions.values(), key=lambda session: (session['created'], session['id']), reverse=True
+        )
+        if 'created[gte]' in params:
+            sessions = [session for session in sessions if session['created'] >= int(params['created[gte]'])]
+        if 'starting_after' in params:
+            ids = [session['id'] for session in sessions]
+            start = ids.index(params['starting_after']) + 1 if params['starting_after'] in ids else len(ids)
+            sessions = sessions[start:]
+        limit = int(params.get('limit', 10))
+        return {
+            'object': 'list',
+            'url': '/v1/checkout/sessions',
+            'data': sessions[:limit],
+            'has_more': len(sessions) > limit,
+        }
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeStripe/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        # Запросы не выводятся, чтобы не мешать замерам
+        pass
+
+    def _send(self, status_code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', _new_id('req'))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status_code, error_type, message):
+        self._send(status_code, {'error': {'type': error_type, 'message': message}})
+
+    def _params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        query = urlsplit(self.path).query
+        return dict(parse_qsl(body or query, keep_blank_values=True))
+
+    def _handle(self, method):
+        params = self._params()
+        path = urlsplit(self.path).path
+
+        with self.state.lock:
+            self.state.requests += 1
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            return self._error(500, 'api_error', 'Injected failure')
+
+        idempotency_key = self.headers.get('Idempotency-Key')
+        with self.state.lock:
+            if method == 'POST' and idempotency_key in self.state.idempotent_responses:
+                return self._send(200, self.state.idempotent_responses[idempotency_key])
+            payload = self._route(method, path, params)
+            if payload is None:
+                return self._error(404, 'invalid_request_error', f'Unrecognized request URL ({method}: {path})')
+            if method == 'POST' and idempotency_key:
+                self.state.idempotent_responses[idempotency_key] = payload
+        self._send(200, payload)
+
+    def _route(self, method, path, params):
+        host = self.headers.get('Host', f'{self.server.server_address[0]}:{self.server.server_address[1]}')
+        if method == 'POST':
+            if path == '/v1/products':
+                return self.state.create_product(params)
+            if path == '/v1/prices':
+                return self.state.create_price(params)
+            if path == '/v1/checkout/sessions':
+                return self.state.create_session(params, f'http://{host}')
+            match = COMPLETE_PATH.match(path)
+            if match and match['session_id'] in self.state.sessions:
+                session = self.state.sessions[match['session_id']]
+                session.update(status='complete', payment_status='paid')
+                return session
+        elif method == 'GET':
+            if path == '/v1/checkout/sessions':
+                return self.state.list_sessions(params)
+            match = SESSION_PATH.match(path)
+            if match:
+                return self.state.sessions.get(match['session_id'])
+        return None
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_GET(self):
+        self._handle('GET')
+
+
+class FakeStripeServer:
+    """
+    Поддельный Stripe в отдельном потоке:
+
+        with FakeStripeServer(latency=0.05) as server:
+            stripe.api_base = server.url
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0):
+        self.state = FakeStripeState(latency=latency, error_rate=error_rate)
+        self.httpd = ThreadingHTTPServer((host, port), FakeStripeHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,27 @@
+import django_filters
+
+from .models import Payment, PaymentDailyRollup
+
+
+class PaymentDailyRollupFilter(django_filters.FilterSet):
+    """
+    Фильтры отчета о выручке: диапазон дней, объект и способ оплаты
+    """
+    date_from = django_filters.DateFilter(field_name='day', lookup_expr='gte')
+    date_to = django_filters.DateFilter(field_name='day', lookup_expr='lte')
+
+    class Meta:
+        model = PaymentDailyRollup
+        fields = ['date_from', 'date_to', 'course', 'lesson', 'payment_method']
+
+
+class PaymentExportFilter(django_filters.FilterSet):
+    """
+    Фильтры выгрузки платежей: диапазон дат, способ оплаты и статус оплаты
+    """
+    date_from = django_filters.DateFilter(field_name='payment_date', lookup_expr='date__gte')
+    date_to = django_filters.DateFilter(field_name='payment_date', lookup_expr='date__lte')
+
+    class Meta:
+        model = Payment
+        fields = ['date_from', 'date_to', 'payment_method', 'is_paid']
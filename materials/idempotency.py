@@ -0,0 +1,93 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IN_PROGRESS = 'in_progress'
+
+
+class IdempotentMixin:
+    """
+    Повтор запроса с тем же заголовком Idempotency-Key возвращает сохраненный ответ
+    вместо повторного выполнения. Ключи принадлежат пользователю и хранятся
+    IDEMPOTENCY_KEY_TIMEOUT секунд
+    """
+
+    def get_idempotency_key(self, request):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return None
+        return f'{request.user.pk}:{key}'
+
+    def get_idempotency_lock_timeout(self):
+        """
+        Время блокировки ключа на время выполнения запроса.
+        Должно быть больше наибольшей длительности обработчика
+        """
+        return settings.IDEMPOTENCY_LOCK_TIMEOUT
+
+    @staticmethod
+    def get_request_fingerprint(request):
+        body = json.dumps(request.data, sort_keys=True, default=str)
+        return hashlib.sha256(f'{request.method}:{request.path}:{body}'.encode()).hexdigest()
+
+    @staticmethod
+    def _cache_key(idempotency_key):
+        return f'materials:idempotency:{hashlib.sha256(idempotency_key.encode()).hexdigest()}'
+
+    def idempotent_response(self, handler, request, *args, **kwargs):
+        idempotency_key = self.get_idempotency_key(request)
+        if idempotency_key is None:
+            return handler(request, *args, **kwargs)
+
+        key = self._cache_key(idempotency_key)
+        fingerprint = self.get_request_fingerprint(request)
+
+        # Блокировка на время выполнения: параллельный повтор получит 409
+        lock_timeout = self.get_idempotency_lock_timeout()
+        if not cache.add(key, (fingerprint, IN_PROGRESS, None, None), lock_timeout):
+            entry = cache.get(key)
+            if entry is not None:
+                return self.replay_response(entry, fingerprint)
+            # Запись истекла между add и get
+            cache.set(key, (fingerprint, IN_PROGRESS, None, None), lock_timeout)
+
+        try:
+            response = handler(request, *args, **kwargs, idempotency_key=idempotency_key)
+        except Exception:
+            cache.delete(key)
+            raise
+
+        if response.status_code >= 500:
+            # Временная ошибка (например, Stripe недоступен): повтор выполнится заново
+            cache.delete(key)
+        else:
+            cache.set(
+                key,
+                (fingerprint, response.status_code, response.data, response.headers.get('Location')),
+                settings.IDEMPOTENCY_KEY_TIMEOUT
+            )
+        return response
+
+    @staticmethod
+    def replay_response(entry, fingerprint):
+        stored_fingerprint, status_code, data, location = entry
+        if stored_fingerprint != fingerprint:
+            return Response(
+                {'error': 'Ключ идемпотентности уже использован с другими параметрами запроса'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if status_code == IN_PROGRESS:
+            return Response(
+                {'error': 'Запрос с этим ключом идемпотентности еще выполняется'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        headers = {'Idempotent-Replayed': 'true'}
+        if location:
+            headers['Location'] = location
+        return Response(data, status=status_code, headers=headers)
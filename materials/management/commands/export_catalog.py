@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from materials.catalog import FORMATS, export_rows, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка курсов и уроков в NDJSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson', help='Формат выгрузки')
+        parser.add_argument('--output', default='-', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Количество строк, читаемых из базы за раз')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = export_rows(chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            written = write_rows(rows, self.stdout, options['format'])
+        else:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                written = write_rows(rows, stream, options['format'])
+
+        elapsed = time.monotonic() - started
+        # Отчет пишется в stderr, чтобы не смешиваться с выгрузкой в stdout
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено строк: {written} за {elapsed:.1f} с ({written / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
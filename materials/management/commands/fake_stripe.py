@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from materials.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Запуск локальной замены Stripe API для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Адрес сервера')
+        parser.add_argument('--port', type=int, default=12111, help='Порт сервера')
+        parser.add_argument('--latency', type=float, default=0.0, help='Задержка каждого ответа, в секундах')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов с ошибкой 500, от 0 до 1')
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Поддельный Stripe запущен на {server.url}. '
+            f'Укажите STRIPE_API_BASE={server.url} в окружении приложения'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
+        self.stdout.write(f'Обработано запросов: {server.state.requests}')
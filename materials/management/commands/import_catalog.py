@@ -0,0 +1,40 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from materials.catalog import FORMATS, CatalogImport, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Потоковая загрузка курсов и уроков из NDJSON или CSV с обновлением по естественному ключу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Файл с каталогом или - для stdin')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson', help='Формат файла')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        catalog_import = CatalogImport(batch_size=options['batch_size'])
+        try:
+            if options['input'] == '-':
+                stats = catalog_import.run(read_rows(sys.stdin, options['format']))
+            else:
+                with open(options['input'], encoding='utf-8', newline='') as stream:
+                    stats = catalog_import.run(read_rows(stream, options['format']))
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f'Ошибка чтения каталога: {e}')
+
+        for error in catalog_import.errors:
+            self.stderr.write(error)
+
+        elapsed = time.monotonic() - started
+        rate = stats['rows'] / max(elapsed, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {stats["rows"]} за {elapsed:.1f} с ({rate:.0f} строк/с). '
+            f'Курсов создано: {stats["courses_created"]}, обновлено: {stats["courses_updated"]}. '
+            f'Уроков создано: {stats["lessons_created"]}, обновлено: {stats["lessons_updated"]}. '
+            f'Пропущено: {stats["skipped"]}'
+        ))
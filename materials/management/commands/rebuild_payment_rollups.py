@@ -0,0 +1,31 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from materials.rollups import rebuild_rollups
+
+
+def day(value):
+    """
+    Дата YYYY-MM-DD. Опечатка не должна превращаться в полную пересборку
+    """
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ArgumentTypeError(f'некорректная дата {value!r}, ожидается YYYY-MM-DD')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Пересборка сводки выручки по истории оплаченных платежей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=day, help='Пересобрать начиная с дня (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки при вставке')
+
+    def handle(self, *args, **options):
+        created = rebuild_rollups(since=options['since'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Создано строк сводки: {created}'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from materials.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков уроков, подписчиков и покупок у курсов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество курсов в пачке')
+
+    def handle(self, *args, **options):
+        checked, repaired = repair_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проверено курсов: {checked}, исправлено: {repaired}'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_stripeprice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_error',
+            field=models.TextField(blank=True, default='', verbose_name='Ошибка создания сессии оплаты'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='checkout_status',
+            field=models.CharField(choices=[('pending', 'Сессия оплаты создается'), ('created', 'Сессия оплаты создана'), ('failed', 'Ошибка создания сессии оплаты')], default='created', max_length=10, verbose_name='Статус сессии оплаты'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0009_payment_checkout_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=100, unique=True, verbose_name='ID события в Stripe')),
+                ('event_type', models.CharField(max_length=100, verbose_name='Тип события')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки')),
+            ],
+            options={
+                'verbose_name': 'Событие Stripe',
+                'verbose_name_plural': 'События Stripe',
+            },
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='status_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата получения статуса из Stripe'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='stripe_status',
+            field=models.CharField(blank=True, default='', max_length=20, verbose_name='Статус сессии в Stripe'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='ID сессии в Stripe'),
+        ),
+    ]
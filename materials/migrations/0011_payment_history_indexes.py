@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:47
+
+from django.conf import settings
+from django.db import migrations, models
+
+from materials.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('materials', '0010_stripe_webhooks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['user', '-payment_date', '-id'], name='materials_pay_user_date_idx'),
+        ),
+    ]
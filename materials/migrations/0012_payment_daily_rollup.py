@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0011_payment_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('payment_method', models.CharField(choices=[('cash', 'Наличные'), ('transfer', 'Перевод на счет')], max_length=10, verbose_name='Способ оплаты')),
+                ('payments_count', models.PositiveIntegerField(default=0, verbose_name='Количество платежей')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payment_rollups', to='materials.course', verbose_name='Курс')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payment_rollups', to='materials.lesson', verbose_name='Урок')),
+            ],
+            options={
+                'verbose_name': 'Выручка за день',
+                'verbose_name_plural': 'Выручка по дням',
+                'ordering': ['-day', 'id'],
+                'indexes': [models.Index(fields=['day'], name='materials_rollup_day_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('course__isnull', False)), fields=('day', 'course', 'payment_method'), name='unique_rollup_course_day'), models.UniqueConstraint(condition=models.Q(('lesson__isnull', False)), fields=('day', 'lesson', 'payment_method'), name='unique_rollup_lesson_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Course = apps.get_model('materials', 'Course')
+    Lesson = apps.get_model('materials', 'Lesson')
+    Subscription = apps.get_model('materials', 'Subscription')
+    Payment = apps.get_model('materials', 'Payment')
+
+    def count_of(queryset):
+        return Coalesce(Subquery(
+            queryset.filter(course=OuterRef('pk')).order_by().values('course')
+            .annotate(total=Count('id')).values('total')
+        ), 0)
+
+    Course.objects.update(
+        lessons_count=count_of(Lesson.objects.all()),
+        subscribers_count=count_of(Subscription.objects.all()),
+        purchases_count=count_of(Payment.objects.filter(is_paid=True)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0012_payment_daily_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lessons_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество уроков'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='purchases_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество оплаченных покупок'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-subscribers_count', 'id'], name='materials_course_subs_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-purchases_count', 'id'], name='materials_course_sales_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
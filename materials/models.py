@@ -11,11 +11,20 @@ class Course(models.Model):
                               verbose_name='Владелец', related_name='courses')
     # Добавляем поле для отслеживания времени обновления
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    # Счетчики обновляются через F() в materials.counters, сверяются командой repair_course_counters
+    lessons_count = models.PositiveIntegerField(default=0, verbose_name='Количество уроков')
+    subscribers_count = models.PositiveIntegerField(default=0, verbose_name='Количество подписчиков')
+    purchases_count = models.PositiveIntegerField(default=0, verbose_name='Количество оплаченных покупок')
 
     class Meta:
         verbose_name = 'Курс'
         verbose_name_plural = 'Курсы'
         ordering = ['id']
+        indexes = [
+            # Сортировка по популярности
+            models.Index(fields=['-subscribers_count', 'id'], name='materials_course_subs_idx'),
+            models.Index(fields=['-purchases_count', 'id'], name='materials_course_sales_idx'),
+        ]
         permissions = [
             ("can_edit_course", "Can edit course"),
         ]
@@ -32,6 +41,7 @@ class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons', verbose_name='Курс')
     owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True,
                              verbose_name='Владелец', related_name='lessons')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
     class Meta:
         verbose_name = 'Урок'
@@ -81,6 +91,15 @@ class Payment(models.Model):
         ('transfer', 'Перевод на счет'),
     ]
 
+    CHECKOUT_PENDING = 'pending'
+    CHECKOUT_CREATED = 'created'
+    CHECKOUT_FAILED = 'failed'
+    CHECKOUT_STATUS_CHOICES = [
+        (CHECKOUT_PENDING, 'Сессия оплаты создается'),
+        (CHECKOUT_CREATED, 'Сессия оплаты создана'),
+        (CHECKOUT_FAILED, 'Ошибка создания сессии оплаты'),
+    ]
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -136,6 +155,7 @@ class Payment(models.Model):
         max_length=100,
         blank=True,
         null=True,
+        db_index=True,
         verbose_name='ID сессии в Stripe'
     )
     stripe_payment_link = models.URLField(
@@ -147,11 +167,37 @@ class Payment(models.Model):
         default=False,
         verbose_name='Оплачено'
     )
+    checkout_status = models.CharField(
+        max_length=10,
+        choices=CHECKOUT_STATUS_CHOICES,
+        default=CHECKOUT_CREATED,
+        verbose_name='Статус сессии оплаты'
+    )
+    checkout_error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='Ошибка создания сессии оплаты'
+    )
+    stripe_status = models.CharField(
+        max_length=20,
+        blank=True,
+        default='',
+        verbose_name='Статус сессии в Stripe'
+    )
+    status_checked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата получения статуса из Stripe'
+    )
 
     class Meta:
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
         ordering = ['-payment_date']
+        indexes = [
+            # История платежей пользователя (PaymentListAPIView)
+            models.Index(fields=['user', '-payment_date', '-id'], name='materials_pay_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"Платеж {self.user.email} - {self.amount} руб."
@@ -163,4 +209,161 @@ class Payment(models.Model):
         if not self.course and not self.lesson:
             raise ValidationError('Должен быть указан курс или урок')
         if self.course and self.lesson:
-            raise ValidationError('Можно указать только курс или только урок')
\ No newline at end of file
+            raise ValidationError('Можно указать только курс или только урок')
+
+
+class StripePrice(models.Model):
+    """
+    Соответствие объекта оплаты, суммы и валюты продукту и цене в Stripe.
+    Позволяет не создавать новые продукт и цену при каждой покупке
+    """
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Курс',
+        related_name='stripe_prices'
+    )
+    lesson = models.ForeignKey(
+        Lesson,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Урок',
+        related_name='stripe_prices'
+    )
+    amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name='Сумма'
+    )
+    currency = models.CharField(
+        max_length=3,
+        default='rub',
+        verbose_name='Валюта'
+    )
+    stripe_product_id = models.CharField(
+        max_length=100,
+        verbose_name='ID продукта в Stripe'
+    )
+    stripe_price_id = models.CharField(
+        max_length=100,
+        verbose_name='ID цены в Stripe'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    class Meta:
+        verbose_name = 'Цена в Stripe'
+        verbose_name_plural = 'Цены в Stripe'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['course', 'amount', 'currency'],
+                condition=models.Q(course__isnull=False),
+                name='unique_stripe_price_course'
+            ),
+            models.UniqueConstraint(
+                fields=['lesson', 'amount', 'currency'],
+                condition=models.Q(lesson__isnull=False),
+                name='unique_stripe_price_lesson'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.stripe_price_id} - {self.amount} {self.currency}"
+
+
+class StripeWebhookEvent(models.Model):
+    """
+    Полученные события Stripe. Уникальный id события защищает от повторной обработки
+    """
+    event_id = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name='ID события в Stripe'
+    )
+    event_type = models.CharField(
+        max_length=100,
+        verbose_name='Тип события'
+    )
+    received_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата получения'
+    )
+    processed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата обработки'
+    )
+
+    class Meta:
+        verbose_name = 'Событие Stripe'
+        verbose_name_plural = 'События Stripe'
+
+    def __str__(self):
+        return f"{self.event_type} ({self.event_id})"
+
+
+class PaymentDailyRollup(models.Model):
+    """
+    Оплаченные платежи, сгруппированные по дню, объекту оплаты и способу оплаты.
+    Обновляется при оплате платежа (materials.rollups), пересобирается командой rebuild_payment_rollups
+    """
+    day = models.DateField(verbose_name='День')
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Курс',
+        related_name='payment_rollups'
+    )
+    lesson = models.ForeignKey(
+        Lesson,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Урок',
+        related_name='payment_rollups'
+    )
+    payment_method = models.CharField(
+        max_length=10,
+        choices=Payment.PAYMENT_METHOD_CHOICES,
+        verbose_name='Способ оплаты'
+    )
+    payments_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество платежей'
+    )
+    revenue = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+        verbose_name='Выручка'
+    )
+
+    class Meta:
+        verbose_name = 'Выручка за день'
+        verbose_name_plural = 'Выручка по дням'
+        ordering = ['-day', 'id']
+        indexes = [
+            models.Index(fields=['day'], name='materials_rollup_day_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'course', 'payment_method'],
+                condition=models.Q(course__isnull=False),
+                name='unique_rollup_course_day'
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'lesson', 'payment_method'],
+                condition=models.Q(lesson__isnull=False),
+                name='unique_rollup_lesson_day'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day}: {self.payments_count} платежей на {self.revenue} руб."
@@ -1,7 +1,99 @@
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
-class LessonPagination(PageNumberPagination):
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator, который на PostgreSQL берет количество строк из оценки планировщика
+    вместо COUNT(*). Небольшие выборки и другие СУБД считаются точно
+    """
+    exact_count_threshold = 10000  # Ниже этого значения оценка неточна, считаем точно
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate_count()
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+    def _estimate_count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return None
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPageNumberPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с возможностью перейти на курсорную (keyset):
+    ?pagination=cursor. Курсорный режим не выполняет COUNT(*) и OFFSET,
+    поэтому глубокие страницы не замедляются.
+    При cursor_by_default курсорный режим включен по умолчанию, а номера страниц: ?pagination=page
+    """
+    pagination_mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    cursor_ordering = 'id'  # Поле или кортеж полей с уникальным порядком, по которым строится курсор
+    cursor_page_size = None  # По умолчанию совпадает с page_size
+    cursor_by_default = False
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    @property
+    def django_paginator_class(self):
+        if settings.PAGINATION_ESTIMATED_COUNT:
+            return EstimatedCountPaginator
+        return Paginator
+
+    def use_cursor(self, request):
+        mode = request.query_params.get(self.pagination_mode_query_param)
+        if mode == 'page':
+            return False
+        return (
+            mode == 'cursor'
+            or self.cursor_query_param in request.query_params
+            or self.cursor_by_default
+        )
+
+    def get_cursor_paginator(self):
+        paginator = CursorPagination()
+        paginator.ordering = self.cursor_ordering
+        paginator.cursor_query_param = self.cursor_query_param
+        paginator.page_size = self.cursor_page_size or self.page_size
+        paginator.page_size_query_param = self.page_size_query_param
+        paginator.max_page_size = self.max_page_size
+        return paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.get_cursor_paginator()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response_schema(schema)
+        return super().get_paginated_response_schema(schema)
+
+
+class LessonPagination(KeysetPageNumberPagination):
     """
     Пагинатор для уроков
     """
@@ -10,10 +102,32 @@ class LessonPagination(PageNumberPagination):
     max_page_size = 50  # Максимальное количество элементов на странице
 
 
-class CoursePagination(PageNumberPagination):
+class CoursePagination(KeysetPageNumberPagination):
     """
     Пагинатор для курсов
     """
     page_size = 5
     page_size_query_param = 'page_size'
-    max_page_size = 20
\ No newline at end of file
+    max_page_size = 20
+
+
+class PaymentPagination(KeysetPageNumberPagination):
+    """
+    Пагинатор для истории платежей.
+    По умолчанию курсорный по индексу (user, -payment_date, -id).
+    id делает порядок однозначным: платежи с одинаковым временем не пропускаются и не повторяются
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_ordering = ('-payment_date', '-id')
+    cursor_by_default = True
+
+
+class ReportPagination(KeysetPageNumberPagination):
+    """
+    Пагинатор для отчетов
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
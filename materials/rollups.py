@@ -0,0 +1,75 @@
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Payment, PaymentDailyRollup
+
+# Поля платежа, нужные для учета в сводке
+ROLLUP_PAYMENT_FIELDS = ('course_id', 'lesson_id', 'payment_method', 'amount', 'payment_date')
+
+
+def record_paid_payments(payments):
+    """
+    Добавляет в сводку платежи, ставшие оплаченными.
+    payments: словари с полями ROLLUP_PAYMENT_FIELDS.
+    Вызывается в той же транзакции, что и выставление is_paid
+    """
+    totals = defaultdict(lambda: [0, Decimal('0')])
+    for payment in payments:
+        key = (
+            timezone.localdate(payment['payment_date']),
+            payment['course_id'],
+            payment['lesson_id'],
+            payment['payment_method'],
+        )
+        totals[key][0] += 1
+        totals[key][1] += payment['amount']
+
+    for (day, course_id, lesson_id, payment_method), (count, revenue) in totals.items():
+        _add_to_rollup(day, course_id, lesson_id, payment_method, count, revenue)
+
+
+def _add_to_rollup(day, course_id, lesson_id, payment_method, count, revenue):
+    # Атомарное увеличение через F(); строка создается только при первом платеже за день
+    lookup = {'day': day, 'course_id': course_id, 'lesson_id': lesson_id, 'payment_method': payment_method}
+    increment = {'payments_count': F('payments_count') + count, 'revenue': F('revenue') + revenue}
+    if PaymentDailyRollup.objects.filter(**lookup).update(**increment):
+        return
+    try:
+        with transaction.atomic():
+            PaymentDailyRollup.objects.create(payments_count=count, revenue=revenue, **lookup)
+    except IntegrityError:
+        # Строку успел создать параллельный платеж
+        PaymentDailyRollup.objects.filter(**lookup).update(**increment)
+
+
+def rebuild_rollups(since=None, batch_size=1000):
+    """
+    Пересборка сводки по истории оплаченных платежей, начиная с дня since.
+    Возвращает число созданных строк
+    """
+    payments = Payment.objects.filter(is_paid=True)
+    rollups = PaymentDailyRollup.objects.all()
+    if since:
+        payments = payments.filter(payment_date__date__gte=since)
+        rollups = rollups.filter(day__gte=since)
+
+    rows = (
+        payments.annotate(day=TruncDate('payment_date'))
+        .values('day', 'course_id', 'lesson_id', 'payment_method')
+        .annotate(payments_count=Count('id'), revenue=Sum('amount'))
+        .order_by()
+    )
+    created = 0
+    with transaction.atomic():
+        rollups.delete()
+        iterator = rows.iterator(chunk_size=batch_size)
+        while batch := list(islice(iterator, batch_size)):
+            PaymentDailyRollup.objects.bulk_create([PaymentDailyRollup(**row) for row in batch])
+            created += len(batch)
+    return created
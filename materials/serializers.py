@@ -1,7 +1,8 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Course, Lesson, Subscription
 from .validators import YouTubeLinkValidator, validate_youtube_link
-from .models import Payment
+from .models import Payment, PaymentDailyRollup
 
 
 class LessonSerializer(serializers.ModelSerializer):
@@ -23,6 +24,73 @@ class LessonSerializer(serializers.ModelSerializer):
         ]
 
 
+class LessonBulkListSerializer(serializers.ListSerializer):
+    """
+    Создание и изменение списка уроков: проверка всего списка за один проход
+    и запись одним bulk_create или bulk_update
+    """
+
+    def to_internal_value(self, data):
+        # Ошибки возвращаются списком по позициям, как и ошибки отдельных уроков
+        attrs = super().to_internal_value(data)
+        errors = []
+        course_ids = {item['course_id'] for item in attrs if 'course_id' in item}
+        existing = set(Course.objects.filter(pk__in=course_ids).values_list('pk', flat=True))
+        lessons = {lesson.pk: lesson for lesson in self.instance} if self.instance is not None else None
+        seen = set()
+
+        for item in attrs:
+            item_errors = {}
+            if item.get('course_id') is not None and item['course_id'] not in existing:
+                item_errors['course'] = [f'Курс с id {item["course_id"]} не найден']
+            lesson_id = item.get('id')
+            if lessons is not None:
+                if lesson_id is None:
+                    item_errors['id'] = ['Обязательное поле']
+                elif lesson_id in seen:
+                    item_errors['id'] = ['Урок указан несколько раз']
+                elif lesson_id not in lessons:
+                    item_errors['id'] = [f'Урок с id {lesson_id} не найден']
+                seen.add(lesson_id)
+            errors.append(item_errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def create(self, validated_data):
+        lessons = [Lesson(**{key: value for key, value in item.items() if key != 'id'}) for item in validated_data]
+        return Lesson.objects.bulk_create(lessons)
+
+    def update(self, instance, validated_data):
+        lessons = {lesson.pk: lesson for lesson in instance}
+        fields = {'updated_at'}
+        now = timezone.now()
+        updated = []
+        for item in validated_data:
+            lesson = lessons[item['id']]
+            for field, value in item.items():
+                if field != 'id':
+                    setattr(lesson, field, value)
+                    fields.add(field)
+            # bulk_update не заполняет auto_now
+            lesson.updated_at = now
+            updated.append(lesson)
+        Lesson.objects.bulk_update(updated, sorted(fields))
+        return updated
+
+
+class LessonBulkSerializer(LessonSerializer):
+    """
+    Урок в массовом создании и изменении. Курс проверяется одним запросом на весь список
+    """
+    id = serializers.IntegerField(required=False, min_value=1)
+    course = serializers.IntegerField(source='course_id', min_value=1)
+
+    class Meta(LessonSerializer.Meta):
+        list_serializer_class = LessonBulkListSerializer
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
@@ -30,8 +98,22 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'subscribed_at']
 
 
+class SubscriptionBulkSerializer(serializers.Serializer):
+    """
+    Сериализатор для массовой подписки и отписки
+    """
+    SUBSCRIBE = 'subscribe'
+    UNSUBSCRIBE = 'unsubscribe'
+
+    course_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=500
+    )
+    action = serializers.ChoiceField(choices=[SUBSCRIBE, UNSUBSCRIBE], default=SUBSCRIBE)
+
+
 class CourseSerializer(serializers.ModelSerializer):
-    lessons_count = serializers.SerializerMethodField()
     lessons = LessonSerializer(many=True, read_only=True)
     owner_email = serializers.EmailField(source='owner.email', read_only=True)
     is_subscribed = serializers.SerializerMethodField()
@@ -39,19 +121,21 @@ class CourseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Course
         fields = '__all__'
-        read_only_fields = ['owner']
-
-    def get_lessons_count(self, obj):
-        return obj.lessons.count()
+        # Счетчики хранятся в курсе и обновляются автоматически
+        read_only_fields = ['owner', 'lessons_count', 'subscribers_count', 'purchases_count']
 
     def get_is_subscribed(self, obj):
         """
         Проверяет, подписан ли текущий пользователь на курс
         """
+        subscribed_ids = self.context.get('subscribed_course_ids')
+        if subscribed_ids is not None:
+            return obj.id in subscribed_ids
+
         user = self.context['request'].user
         if user.is_authenticated:
             return Subscription.objects.filter(
-                user=user,
+                user_id=user.pk,
                 course=obj
             ).exists()
         return False
@@ -75,6 +159,20 @@ class PaymentSerializer(serializers.ModelSerializer):
         ]
 
 
+class PaymentCheckoutSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для получения ссылки на оплату по id платежа
+    """
+
+    class Meta:
+        model = Payment
+        fields = [
+            'id', 'amount', 'checkout_status', 'checkout_error',
+            'stripe_session_id', 'stripe_payment_link', 'is_paid'
+        ]
+        read_only_fields = fields
+
+
 class PaymentCreateSerializer(serializers.Serializer):
     """
     Сериализатор для создания платежа
@@ -115,4 +213,20 @@ class PaymentStatusSerializer(serializers.Serializer):
         max_digits=10,
         decimal_places=2,
         read_only=True
-    )
\ No newline at end of file
+    )
+
+
+class PaymentDailyRollupSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор строки сводки выручки
+    """
+    course_title = serializers.CharField(source='course.title', read_only=True, default=None)
+    lesson_title = serializers.CharField(source='lesson.title', read_only=True, default=None)
+
+    class Meta:
+        model = PaymentDailyRollup
+        fields = [
+            'day', 'course', 'course_title', 'lesson', 'lesson_title',
+            'payment_method', 'payments_count', 'revenue'
+        ]
+        read_only_fields = fields
@@ -1,80 +1,213 @@
 import os
+from datetime import timedelta
+from decimal import Decimal
+
 import stripe
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .stripe_client import StripeUnavailable, configure_stripe, stripe_breaker
 
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+configure_stripe()
 
 HOST = os.getenv('HOST')
 
+# Сколько последних сумм одного объекта оплаты хранится в кеше цен.
+# Сумму передает клиент, поэтому число записей на объект ограничено
+MAX_CACHED_PRICES = 10
+
+
 class StripeService:
     """
-    Сервис для работы с Stripe API
+    Сервис для работы с Stripe API.
+    Все вызовы проходят через автомат защиты stripe_breaker
     """
 
     @staticmethod
-    def create_product(name, description=None):
+    def _request(method, error_message, idempotency_key=None, **params):
+        if idempotency_key:
+            # Повтор с тем же ключом Stripe не выполняет повторно, а возвращает прошлый результат
+            params['idempotency_key'] = idempotency_key
+        try:
+            return stripe_breaker.call(method, **params)
+        except stripe_breaker.failure_exceptions:
+            # Таймаут, обрыв соединения или ошибка на стороне Stripe после всех повторов SDK:
+            # ответ 503 не сохраняется по ключу идемпотентности, повтор выполнится заново
+            raise StripeUnavailable()
+        except stripe.StripeError as e:
+            raise ValidationError(f"{error_message}: {e}")
+
+    @staticmethod
+    def create_product(name, description=None, idempotency_key=None):
         """
         Создание продукта в Stripe
         """
-        try:
-            product = stripe.Product.create(
-                name=name,
-                description=description
-            )
-            return product
-        except stripe.error.StripeError as e:
-            raise ValidationError(f"Ошибка создания продукта в Stripe: {e}")
+        return StripeService._request(
+            stripe.Product.create,
+            'Ошибка создания продукта в Stripe',
+            idempotency_key=idempotency_key,
+            name=name,
+            description=description
+        )
 
     @staticmethod
-    def create_price(product_id, amount, currency='rub'):
+    def create_price(product_id, amount, currency='rub', idempotency_key=None):
         """
         Создание цены в Stripe
         amount: сумма в рублях (будет преобразована в копейки)
         """
-        try:
-            # Преобразуем рубли в копейки
-            amount_in_cents = int(amount * 100)
+        # Преобразуем рубли в копейки
+        amount_in_cents = int(amount * 100)
 
-            price = stripe.Price.create(
-                product=product_id,
-                unit_amount=amount_in_cents,
-                currency=currency,
-            )
-            return price
-        except stripe.error.StripeError as e:
-            raise ValidationError(f"Ошибка создания цены в Stripe: {e}")
+        return StripeService._request(
+            stripe.Price.create,
+            'Ошибка создания цены в Stripe',
+            idempotency_key=idempotency_key,
+            product=product_id,
+            unit_amount=amount_in_cents,
+            currency=currency,
+        )
 
     @staticmethod
-    def create_checkout_session(price_id, success_url, cancel_url, metadata=None):
+    def create_checkout_session(price_id, success_url, cancel_url, metadata=None, price_data=None,
+                                idempotency_key=None):
         """
-        Создание сессии оплаты в Stripe
+        Создание сессии оплаты в Stripe.
+        Вместо price_id можно передать price_data: цена и продукт создаются тем же вызовом
         """
-        try:
-            session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price': price_id,
-                    'quantity': 1,
-                }],
-                mode='payment',
-                success_url=success_url,
-                cancel_url=cancel_url,
-                metadata=metadata or {}
-            )
-            return session
-        except stripe.error.StripeError as e:
-            raise ValidationError(f"Ошибка создания сессии оплаты в Stripe: {e}")
+        line_item = {'price_data': price_data} if price_data else {'price': price_id}
+        return StripeService._request(
+            stripe.checkout.Session.create,
+            'Ошибка создания сессии оплаты в Stripe',
+            idempotency_key=idempotency_key,
+            payment_method_types=['card'],
+            line_items=[{
+                **line_item,
+                'quantity': 1,
+            }],
+            mode='payment',
+            success_url=success_url,
+            cancel_url=cancel_url,
+            metadata=metadata or {}
+        )
 
     @staticmethod
     def retrieve_session(session_id):
         """
         Получение информации о сессии
         """
+        return StripeService._request(
+            stripe.checkout.Session.retrieve,
+            'Ошибка получения сессии из Stripe',
+            id=session_id
+        )
+
+    @staticmethod
+    def list_sessions(created_gte, page_size=100):
+        """
+        Сессии оплаты, созданные не раньше created_gte (timestamp), постранично
+        """
+        params = {'created': {'gte': created_gte}, 'limit': page_size}
+        while True:
+            page = StripeService._request(
+                stripe.checkout.Session.list,
+                'Ошибка получения списка сессий из Stripe',
+                **params
+            )
+            yield from page.data
+            if not page.has_more:
+                return
+            params['starting_after'] = page.data[-1].id
+
+
+class StripePriceService:
+    """
+    Повторное использование продуктов и цен Stripe.
+    Поиск идет по цепочке: общий кеш, база данных, и только затем Stripe.
+    Кеш хранит одну запись на объект оплаты: {сумма:валюта -> (id продукта, id цены)}
+    """
+
+    @staticmethod
+    def _cache_key(object_type, object_id):
+        return f'materials:stripe_price:{object_type}:{object_id}'
+
+    @classmethod
+    def get_price_ids(cls, payment_object, object_type, amount, currency='rub', idempotency_key=None):
+        """
+        Возвращает пару (id продукта, id цены) для объекта оплаты и суммы
+        """
+        from .models import StripePrice
+
+        amount = Decimal(amount).quantize(Decimal('0.01'))
+        key = cls._cache_key(object_type, payment_object.id)
+        price_key = f'{amount}:{currency}'
+
+        prices = cache.get(key) or {}
+        ids = prices.get(price_key)
+        if ids is not None:
+            return ids
+
+        lookup = {object_type: payment_object, 'amount': amount, 'currency': currency}
+        mapping = StripePrice.objects.filter(**lookup).values_list(
+            'stripe_product_id', 'stripe_price_id'
+        ).first()
+        if mapping is None:
+            mapping = cls._create_price(payment_object, lookup, idempotency_key)
+        ids = tuple(mapping)
+
+        # Самые давно добавленные суммы вытесняются
+        prices[price_key] = ids
+        while len(prices) > MAX_CACHED_PRICES:
+            del prices[next(iter(prices))]
+        cache.set(key, prices, settings.STRIPE_PRICE_CACHE_TIMEOUT)
+        return ids
+
+    @staticmethod
+    def _create_price(payment_object, lookup, idempotency_key=None):
+        from .models import StripePrice
+
+        product = StripeService.create_product(
+            name=payment_object.title,
+            description=payment_object.description,
+            idempotency_key=idempotency_key and f'{idempotency_key}:product'
+        )
+        price = StripeService.create_price(
+            product_id=product.id,
+            amount=lookup['amount'],
+            currency=lookup['currency'],
+            idempotency_key=idempotency_key and f'{idempotency_key}:price'
+        )
         try:
-            session = stripe.checkout.Session.retrieve(session_id)
-            return session
-        except stripe.error.StripeError as e:
-            raise ValidationError(f"Ошибка получения сессии из Stripe: {e}")
+            StripePrice.objects.create(
+                stripe_product_id=product.id,
+                stripe_price_id=price.id,
+                **lookup
+            )
+        except IntegrityError:
+            # Параллельная покупка успела сохранить свою цену: используем ее,
+            # созданная здесь цена останется неиспользованной
+            return StripePrice.objects.filter(**lookup).values_list(
+                'stripe_product_id', 'stripe_price_id'
+            ).get()
+        return product.id, price.id
+
+    @staticmethod
+    def inline_price_data(payment_object, amount, currency='rub'):
+        """
+        Описание цены для создания сессии без отдельных продукта и цены
+        """
+        product_data = {'name': payment_object.title}
+        if payment_object.description:
+            product_data['description'] = payment_object.description
+        return {
+            'currency': currency,
+            'unit_amount': int(Decimal(amount) * 100),
+            'product_data': product_data,
+        }
 
 
 class PaymentService:
@@ -83,13 +216,10 @@ class PaymentService:
     """
 
     @staticmethod
-    def create_payment_intent(user, course=None, lesson=None, amount=None):
+    def resolve_payment_object(course=None, lesson=None, amount=None):
         """
-        Создание намерения платежа и подготовка данных для Stripe
+        Определение объекта оплаты, его типа и суммы
         """
-        from .models import Payment
-
-        # Определяем объект оплаты и сумму
         if course:
             payment_object = course
             if not amount:
@@ -102,19 +232,24 @@ class PaymentService:
             object_type = 'lesson'
         else:
             raise ValidationError('Должен быть указан курс или урок')
+        return payment_object, object_type, amount
 
-        # Создаем продукт в Stripe
-        stripe_service = StripeService()
-        product = stripe_service.create_product(
-            name=payment_object.title,
-            description=payment_object.description
-        )
-
-        # Создаем цену в Stripe
-        price = stripe_service.create_price(
-            product_id=product.id,
-            amount=amount
-        )
+    @staticmethod
+    def start_checkout(user, payment_object, object_type, amount, payment_id=None, idempotency_key=None):
+        """
+        Создание сессии оплаты в Stripe.
+        idempotency_key передается в Stripe с суффиксом для каждого вызова.
+        Возвращает (id продукта, id цены, сессия)
+        """
+        # Находим продукт и цену в Stripe, созданные при прошлых покупках.
+        # В режиме STRIPE_INLINE_PRICE_DATA цена передается прямо в сессию
+        product_id = price_id = price_data = None
+        if settings.STRIPE_INLINE_PRICE_DATA:
+            price_data = StripePriceService.inline_price_data(payment_object, amount)
+        else:
+            product_id, price_id = StripePriceService.get_price_ids(
+                payment_object, object_type, amount, idempotency_key=idempotency_key
+            )
 
         # Создаем URL для редиректа
         success_url = f"{HOST}/api/payments/success/?session_id={{CHECKOUT_SESSION_ID}}"
@@ -126,13 +261,32 @@ class PaymentService:
             'object_type': object_type,
             'object_id': payment_object.id
         }
+        if payment_id:
+            metadata['payment_id'] = payment_id
 
         # Создаем сессию оплаты
-        session = stripe_service.create_checkout_session(
-            price_id=price.id,
+        session = StripeService.create_checkout_session(
+            price_id=price_id,
             success_url=success_url,
             cancel_url=cancel_url,
-            metadata=metadata
+            metadata=metadata,
+            price_data=price_data,
+            idempotency_key=idempotency_key and f'{idempotency_key}:session'
+        )
+        return product_id, price_id, session
+
+    @staticmethod
+    def create_payment_intent(user, course=None, lesson=None, amount=None, idempotency_key=None):
+        """
+        Создание намерения платежа и подготовка данных для Stripe
+        """
+        from .models import Payment
+
+        # Определяем объект оплаты и сумму
+        payment_object, object_type, amount = PaymentService.resolve_payment_object(course, lesson, amount)
+
+        product_id, price_id, session = PaymentService.start_checkout(
+            user, payment_object, object_type, amount, idempotency_key=idempotency_key
         )
 
         # Создаем запись о платеже в базе данных
@@ -142,8 +296,8 @@ class PaymentService:
             lesson=lesson,
             amount=amount,
             payment_method='transfer',
-            stripe_product_id=product.id,
-            stripe_price_id=price.id,
+            stripe_product_id=product_id,
+            stripe_price_id=price_id,
             stripe_session_id=session.id,
             stripe_payment_link=session.url,
             is_paid=False
@@ -157,28 +311,160 @@ class PaymentService:
         }
 
     @staticmethod
-    def check_payment_status(session_id):
+    def create_pending_payment(user, course=None, lesson=None, amount=None):
+        """
+        Создание платежа без обращения к Stripe.
+        Сессию оплаты затем создает задача create_checkout_session
+        """
+        from .models import Payment
+
+        _, _, amount = PaymentService.resolve_payment_object(course, lesson, amount)
+        return Payment.objects.create(
+            user=user,
+            course=course,
+            lesson=lesson,
+            amount=amount,
+            payment_method='transfer',
+            checkout_status=Payment.CHECKOUT_PENDING,
+            is_paid=False
+        )
+
+    @staticmethod
+    def complete_checkout(payment):
+        """
+        Создание сессии оплаты для отложенного платежа
+        """
+        from .models import Payment
+
+        payment_object, object_type, amount = PaymentService.resolve_payment_object(
+            payment.course, payment.lesson, payment.amount
+        )
+        # Ключ по id платежа: повтор задачи не создаст вторую сессию
+        product_id, price_id, session = PaymentService.start_checkout(
+            payment.user, payment_object, object_type, amount,
+            payment_id=payment.id,
+            idempotency_key=f'payment-{payment.id}'
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            stripe_product_id=product_id,
+            stripe_price_id=price_id,
+            stripe_session_id=session.id,
+            stripe_payment_link=session.url,
+            checkout_status=Payment.CHECKOUT_CREATED,
+            checkout_error=''
+        )
+
+    @staticmethod
+    def apply_session_status(session_id, session_status, payment_status):
+        """
+        Сохранение статуса сессии одним UPDATE платежей и учет новых оплат в сводке выручки и счетчике покупок курса.
+        Возвращает число платежей, ставших оплаченными
+        """
+        from .models import Payment
+        from .counters import record_purchases
+        from .rollups import ROLLUP_PAYMENT_FIELDS, record_paid_payments
+
+        payments = Payment.objects.filter(stripe_session_id=session_id)
+        now = timezone.now()
+        if payment_status != 'paid':
+            payments.update(stripe_status=session_status, status_checked_at=now)
+            return 0
+
+        with transaction.atomic():
+            # Блокировка строк: сверка и повторный вебхук не учтут ту же оплату второй раз
+            newly_paid = list(
+                payments.filter(is_paid=False).select_for_update().values('id', *ROLLUP_PAYMENT_FIELDS)
+            )
+            if newly_paid:
+                Payment.objects.filter(pk__in=[payment['id'] for payment in newly_paid]).update(
+                    is_paid=True,
+                    stripe_status=session_status,
+                    status_checked_at=now
+                )
+                record_paid_payments(newly_paid)
+                record_purchases(newly_paid)
+        return len(newly_paid)
+
+    @staticmethod
+    def reconcile_sessions(sessions):
         """
-        Проверка статуса платежа
+        Применение статусов пачки сессий {id сессии: сессия} к платежам.
+        Измененные платежи сохраняются через bulk_update, у остальных обновляется только время проверки.
+        Возвращает (число измененных платежей, число ставших оплаченными)
         """
         from .models import Payment
+        from .counters import record_purchases
+        from .rollups import ROLLUP_PAYMENT_FIELDS, record_paid_payments
+
+        now = timezone.now()
+        changed = []
+        unchanged = []
+        newly_paid = []
+        with transaction.atomic():
+            # Блокировка строк: параллельный вебхук не учтет ту же оплату второй раз
+            payments = Payment.objects.filter(stripe_session_id__in=list(sessions)).select_for_update().only(
+                'id', 'stripe_session_id', 'is_paid', 'stripe_status', 'status_checked_at', *ROLLUP_PAYMENT_FIELDS
+            )
+            for payment in payments:
+                session = sessions[payment.stripe_session_id]
+                # Оплата не отменяется: is_paid только выставляется
+                is_paid = payment.is_paid or session.payment_status == 'paid'
+                if is_paid == payment.is_paid and session.status == payment.stripe_status:
+                    unchanged.append(payment.id)
+                    continue
+                if is_paid and not payment.is_paid:
+                    newly_paid.append({field: getattr(payment, field) for field in ROLLUP_PAYMENT_FIELDS})
+                payment.is_paid = is_paid
+                payment.stripe_status = session.status
+                payment.status_checked_at = now
+                changed.append(payment)
+
+            if changed:
+                Payment.objects.bulk_update(changed, ['is_paid', 'stripe_status', 'status_checked_at'])
+            if unchanged:
+                Payment.objects.filter(pk__in=unchanged).update(status_checked_at=now)
+            record_paid_payments(newly_paid)
+            record_purchases(newly_paid)
+        return len(changed), len(newly_paid)
 
-        stripe_service = StripeService()
-        session = stripe_service.retrieve_session(session_id)
+    @staticmethod
+    def is_status_stale(payment):
+        """
+        Неоплаченная сессия, по которой давно не было событий от Stripe.
+        Без настроенных вебхуков события не приходят, и локальный статус всегда считается устаревшим
+        """
+        if payment.is_paid or payment.stripe_status == 'expired':
+            return False
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return True
+        checked_at = payment.status_checked_at or payment.payment_date
+        return timezone.now() - checked_at > timedelta(seconds=settings.PAYMENT_STATUS_STALE_AFTER)
+
+    @staticmethod
+    def check_payment_status(session_id, confirm=False):
+        """
+        Проверка статуса платежа.
+        Статус приходит вебхуками, Stripe опрашивается только для давно не обновлявшихся неоплаченных сессий.
+        confirm: пользователь вернулся со страницы оплаты, а вебхук мог еще не прийти,
+        поэтому неоплаченная и не истекшая сессия проверяется в Stripe сразу
+        """
+        from .models import Payment
 
         # Находим соответствующий платеж
         try:
             payment = Payment.objects.get(stripe_session_id=session_id)
-            if session.payment_status == 'paid' and not payment.is_paid:
-                payment.is_paid = True
-                payment.save()
-
-            return {
-                'session_id': session_id,
-                'payment_status': session.payment_status,
-                'is_paid': payment.is_paid,
-                'amount_total': session.amount_total / 100  # Преобразуем обратно в рубли
-            }
         except Payment.DoesNotExist:
             raise ValidationError('Платеж не найден')
 
+        awaiting_webhook = confirm and not payment.is_paid and payment.stripe_status != 'expired'
+        if awaiting_webhook or PaymentService.is_status_stale(payment):
+            session = StripeService.retrieve_session(session_id)
+            PaymentService.apply_session_status(session_id, session.status, session.payment_status)
+            payment.refresh_from_db(fields=['is_paid', 'stripe_status', 'status_checked_at'])
+
+        return {
+            'session_id': session_id,
+            'payment_status': 'paid' if payment.is_paid else 'unpaid',
+            'is_paid': payment.is_paid,
+            'amount_total': payment.amount
+        }
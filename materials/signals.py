@@ -0,0 +1,117 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import COURSES_VERSION, LESSONS_VERSION, bump_versions, subscriptions_version
+from .counters import adjust_counter
+from .models import Course, Lesson, Payment, Subscription
+from .rollups import ROLLUP_PAYMENT_FIELDS, record_paid_payments
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_course_cache(sender, instance, **kwargs):
+    """
+    Сброс закешированных ответов по курсам
+    """
+    bump_versions(COURSES_VERSION)
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def invalidate_lesson_cache(sender, instance, **kwargs):
+    """
+    Уроки входят и в ответы по курсам, поэтому сбрасываются обе группы
+    """
+    bump_versions(COURSES_VERSION, LESSONS_VERSION)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_cache(sender, instance, **kwargs):
+    """
+    Подписка влияет только на поле is_subscribed в ответах ее пользователя
+    """
+    bump_versions(subscriptions_version(instance.user_id))
+
+
+def course_deleted(instance, origin):
+    """
+    Объект удаляется каскадом вместе со своим курсом: счетчик курса обновлять незачем
+    """
+    if isinstance(origin, Course):
+        return instance.course_id == origin.pk
+    return isinstance(origin, QuerySet) and origin.model is Course
+
+
+@receiver(pre_save, sender=Lesson)
+def remember_lesson_course(sender, instance, **kwargs):
+    """
+    Курс урока до сохранения: урок может быть перенесен в другой курс
+    """
+    instance._previous_course_id = None
+    if not instance._state.adding:
+        instance._previous_course_id = Lesson.objects.filter(pk=instance.pk).values_list(
+            'course_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Lesson)
+def count_saved_lesson(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter('lessons_count', {instance.course_id: 1})
+    elif instance._previous_course_id not in (None, instance.course_id):
+        adjust_counter('lessons_count', {instance._previous_course_id: -1, instance.course_id: 1})
+
+
+@receiver(post_delete, sender=Lesson)
+def count_deleted_lesson(sender, instance, origin=None, **kwargs):
+    if not course_deleted(instance, origin):
+        adjust_counter('lessons_count', {instance.course_id: -1})
+
+
+@receiver(post_save, sender=Subscription)
+def count_saved_subscription(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter('subscribers_count', {instance.course_id: 1})
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscription(sender, instance, origin=None, **kwargs):
+    if not course_deleted(instance, origin):
+        adjust_counter('subscribers_count', {instance.course_id: -1})
+
+
+@receiver(pre_save, sender=Payment)
+def remember_payment_paid(sender, instance, update_fields=None, **kwargs):
+    """
+    Статус оплаты до сохранения: оплата может быть выставлена через save() (админка, shell)
+    """
+    instance._previous_is_paid = None
+    if instance._state.adding or (update_fields is not None and 'is_paid' not in update_fields):
+        return
+    instance._previous_is_paid = Payment.objects.filter(pk=instance.pk).values_list(
+        'is_paid', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Payment)
+def count_saved_payment(sender, instance, created, **kwargs):
+    """
+    Платеж, созданный оплаченным или сменивший статус оплаты через save().
+    PaymentService выставляет оплату через update() и учитывает ее сам
+    """
+    was_paid = False if created else getattr(instance, '_previous_is_paid', None)
+    if was_paid is None or was_paid == instance.is_paid:
+        return
+    if instance.is_paid:
+        record_paid_payments([{field: getattr(instance, field) for field in ROLLUP_PAYMENT_FIELDS}])
+        adjust_counter('purchases_count', {instance.course_id: 1})
+    else:
+        adjust_counter('purchases_count', {instance.course_id: -1})
+
+
+@receiver(post_delete, sender=Payment)
+def count_deleted_payment(sender, instance, origin=None, **kwargs):
+    if instance.is_paid and not course_deleted(instance, origin):
+        adjust_counter('purchases_count', {instance.course_id: -1})
@@ -0,0 +1,160 @@
+import logging
+import math
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая пауза SDK перед повтором: заголовок Retry-After учитывается до 60 секунд
+STRIPE_MAX_RETRY_DELAY = 60
+
+
+class StripeUnavailable(APIException):
+    """
+    Stripe недоступен или автомат защиты разомкнут
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Платежный сервис временно недоступен, попробуйте позже'
+    default_code = 'stripe_unavailable'
+
+
+def build_http_client():
+    """
+    HTTP-клиент Stripe с пулом keep-alive соединений и ограниченными таймаутами
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.STRIPE_POOL_SIZE,
+        # Повторы выполняет сам SDK (max_network_retries) с экспоненциальной задержкой и jitter
+        max_retries=0,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return stripe.RequestsClient(
+        timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        session=session,
+    )
+
+
+def request_budget(calls=1):
+    """
+    Наибольшая длительность calls последовательных запросов к Stripe
+    с учетом таймаутов и повторов SDK, в секундах
+    """
+    retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    per_call = (retries + 1) * (settings.STRIPE_CONNECT_TIMEOUT + settings.STRIPE_READ_TIMEOUT) \
+        + retries * STRIPE_MAX_RETRY_DELAY
+    return math.ceil(calls * per_call)
+
+
+def configure_stripe():
+    """
+    Настройка SDK: общий клиент, бюджет повторов и адрес API
+    """
+    stripe.default_http_client = build_http_client()
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    if settings.STRIPE_API_BASE:
+        # Например, локальный сервер из команды fake_stripe
+        stripe.api_base = settings.STRIPE_API_BASE
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты внешнего сервиса. Состояние хранится в общем кеше,
+    поэтому все воркеры видят его одинаково.
+
+    Закрыт: вызовы проходят, сбои считаются в окне.
+    Разомкнут: после порога сбоев вызовы сразу отклоняются.
+    Полуоткрыт: по истечении паузы проходит один пробный вызов
+    """
+    # Сбои сервиса, а не ошибки в самом запросе
+    failure_exceptions = (
+        stripe.APIConnectionError,
+        stripe.APIError,
+        stripe.RateLimitError,
+    )
+
+    def __init__(self, name):
+        self.name = name
+
+    def _key(self, suffix):
+        return f'materials:breaker:{self.name}:{suffix}'
+
+    def _increment(self, suffix, timeout=None):
+        key = self._key(suffix)
+        if not cache.add(key, 1, timeout):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout)
+
+    def state(self):
+        opened_until = cache.get(self._key('opened_until'))
+        if opened_until is None:
+            return 'closed'
+        if opened_until > time.time():
+            return 'open'
+        return 'half_open'
+
+    def call(self, func, *args, **kwargs):
+        state = self.state()
+        if state == 'open' or (
+            # Пробный вызов выполняет только один воркер
+            state == 'half_open'
+            and not cache.add(self._key('probe'), 1, settings.STRIPE_READ_TIMEOUT)
+        ):
+            self._increment('rejected')
+            raise StripeUnavailable()
+
+        self._increment('calls')
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure(state)
+            raise
+        finally:
+            if state == 'half_open':
+                cache.delete(self._key('probe'))
+
+        if state != 'closed':
+            self.reset()
+        return result
+
+    def record_failure(self, state):
+        self._increment('errors')
+        self._increment('failures', settings.STRIPE_BREAKER_WINDOW)
+        failures = cache.get(self._key('failures'), 0)
+        if state == 'half_open' or failures >= settings.STRIPE_BREAKER_FAILURE_THRESHOLD:
+            cache.set(
+                self._key('opened_until'),
+                time.time() + settings.STRIPE_BREAKER_RESET_TIMEOUT,
+                timeout=None
+            )
+            cache.delete(self._key('failures'))
+            self._increment('opened')
+            logger.warning('Автомат %s разомкнут после %s сбоев', self.name, failures)
+
+    def reset(self):
+        cache.delete_many([self._key('opened_until'), self._key('failures')])
+        logger.info('Автомат %s замкнут', self.name)
+
+    def stats(self):
+        """
+        Состояние и счетчики автомата для метрик
+        """
+        counters = ('calls', 'errors', 'failures', 'rejected', 'opened')
+        values = cache.get_many([self._key(counter) for counter in counters])
+        data = {counter: values.get(self._key(counter), 0) for counter in counters}
+        data['state'] = self.state()
+        return data
+
+
+stripe_breaker = CircuitBreaker('stripe')
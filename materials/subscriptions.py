@@ -0,0 +1,66 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_versions, subscriptions_version
+from .counters import adjust_counter
+from .models import Course, Subscription
+
+# Подписка и отписка одним SQL-запросом с RETURNING (PostgreSQL, SQLite 3.35+).
+# Запросы в обход ORM не вызывают сигналы, поэтому счетчики подписчиков
+# и кеш ответов пользователя обновляются здесь по строкам, которые действительно изменились
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def unsubscribe(user_id, course_ids):
+    """
+    Удаляет подписки пользователя. Возвращает id курсов, от которых он действительно отписался
+    """
+    course_ids = list(course_ids)
+    if not course_ids:
+        return []
+    table = connection.ops.quote_name(Subscription._meta.db_table)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE user_id = %s AND course_id IN ({_placeholders(course_ids)}) '
+                f'RETURNING course_id',
+                [user_id, *course_ids]
+            )
+            removed = [course_id for course_id, in cursor.fetchall()]
+        adjust_counter('subscribers_count', dict.fromkeys(removed, -1))
+    if removed:
+        bump_versions(subscriptions_version(user_id))
+    return removed
+
+
+def subscribe(user_id, course_ids):
+    """
+    Подписывает пользователя на существующие курсы из course_ids.
+    Уже существующие подписки пропускаются. Возвращает созданные подписки
+    """
+    course_ids = list(course_ids)
+    if not course_ids:
+        return []
+    table = connection.ops.quote_name(Subscription._meta.db_table)
+    course_table = connection.ops.quote_name(Course._meta.db_table)
+    now = timezone.now()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # WHERE обязателен: без него SQLite не отличит ON CONFLICT от условия соединения
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, course_id, subscribed_at) '
+                f'SELECT %s, id, %s FROM {course_table} WHERE id IN ({_placeholders(course_ids)}) '
+                f'ON CONFLICT (user_id, course_id) DO NOTHING RETURNING id, course_id',
+                [user_id, connection.ops.adapt_datetimefield_value(now), *course_ids]
+            )
+            created = [
+                Subscription(id=pk, user_id=user_id, course_id=course_id, subscribed_at=now)
+                for pk, course_id in cursor.fetchall()
+            ]
+        adjust_counter('subscribers_count', dict.fromkeys((subscription.course_id for subscription in created), 1))
+    if created:
+        bump_versions(subscriptions_version(user_id))
+    return created
@@ -0,0 +1,299 @@
+import math
+import multiprocessing
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.utils import timezone
+
+# Синтетические данные для воспроизведения планов запросов на объемах, близких к рабочим.
+# Генерация детерминирована: каждая пачка строк получает свой генератор случайных чисел
+# от (seed, этап, начало пачки), поэтому результат не зависит от числа процессов.
+# Номера в email и названиях дополнены нулями, чтобы порядок по ним совпадал с порядком генерации
+
+SYNTHETIC_PASSWORD = 'synthetic'
+PAYMENT_METHODS = ('transfer', 'cash')
+PAYMENT_METHOD_WEIGHTS = (0.8, 0.2)
+
+# Данные этапа для процессов-исполнителей (задаются в initializer пула)
+_context = {}
+
+
+def user_email(seed, number):
+    return f'synthetic-{seed}-{number:09d}@example.com'
+
+
+def course_title(number):
+    return f'Синтетический курс {number:09d}'
+
+
+def lesson_title(number):
+    return f'Урок {number:05d}'
+
+
+def chunk_ranges(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def zipf_cum_weights(count, exponent):
+    """
+    Накопленные веса рангов 1..count по закону Ципфа: первые курсы самые популярные
+    """
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def geometric(rng, mean):
+    """
+    Неотрицательное целое с геометрическим распределением и заданным средним
+    """
+    if mean <= 0:
+        return 0
+    p = 1 / (mean + 1)
+    return int(math.log(1 - rng.random()) / math.log(1 - p))
+
+
+@contextmanager
+def historical_dates(*fields):
+    """
+    Временно отключает auto_now_add, чтобы bulk_create сохранил даты из прошлого
+    """
+    previous = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, previous):
+            field.auto_now_add = value
+
+
+def _init_worker(context):
+    # Процесс, запущенный через spawn, настраивает Django заново
+    django.setup()
+    _context.clear()
+    _context.update(context)
+
+
+def _run_chunk(task):
+    phase, start, stop = task
+    return PHASES[phase](_context, random.Random(f'{_context["seed"]}:{phase}:{start}'), start, stop)
+
+
+def create_users(context, rng, start, stop):
+    from users.models import User
+
+    now = timezone.now()
+    users = []
+    for number in range(start, stop):
+        joined = now - timedelta(days=rng.uniform(0, context['days']))
+        users.append(User(
+            email=user_email(context['seed'], number),
+            password=context['password'],
+            first_name=f'User {number}',
+            # Примерно каждый десятый не заходил больше месяца
+            last_login=now - timedelta(days=min(rng.expovariate(1 / 13), (now - joined).days)),
+            date_joined=joined,
+            is_active=rng.random() > 0.02,
+        ))
+    User.objects.bulk_create(users, batch_size=context['batch_size'])
+    return len(users)
+
+
+def create_courses(context, rng, start, stop):
+    from .models import Course
+
+    owner_ids = context['owner_ids']
+    courses = [
+        Course(
+            title=course_title(number),
+            description=f'Описание курса {number}',
+            owner_id=owner_ids[number // context['courses_per_owner']],
+        )
+        for number in range(start, stop)
+    ]
+    Course.objects.bulk_create(courses, batch_size=context['batch_size'])
+    return len(courses)
+
+
+def create_lessons(context, rng, start, stop):
+    from .models import Lesson
+
+    lessons = []
+    mean = context['lessons_per_course']
+    for number in range(start, stop):
+        course_id, owner_id = context['course_ids'][number], context['course_owner_ids'][number]
+        # Логнормальное распределение: большинство курсов короткие, немногие очень длинные
+        count = max(1, round(rng.lognormvariate(math.log(mean) - 0.5, 1))) if mean else 0
+        lessons.extend(
+            Lesson(
+                title=lesson_title(index),
+                course_id=course_id,
+                owner_id=owner_id,
+                video_link=f'https://www.youtube.com/watch?v={course_id}-{index}',
+            )
+            for index in range(count)
+        )
+    Lesson.objects.bulk_create(lessons, batch_size=context['batch_size'])
+    return len(lessons)
+
+
+def create_subscriptions(context, rng, start, stop):
+    from .models import Subscription
+
+    course_ids, cum_weights = context['course_ids'], context['cum_weights']
+    subscriptions = []
+    for number in range(start, stop):
+        count = min(geometric(rng, context['subscriptions_per_user']), len(course_ids))
+        chosen = set(rng.choices(course_ids, cum_weights=cum_weights, k=count)) if count else ()
+        subscriptions.extend(
+            Subscription(user_id=context['user_ids'][number], course_id=course_id) for course_id in chosen
+        )
+    Subscription.objects.bulk_create(subscriptions, batch_size=context['batch_size'], ignore_conflicts=True)
+    return len(subscriptions)
+
+
+def create_payments(context, rng, start, stop):
+    from users.models import Payment as UserPayment
+    from .models import Payment
+
+    course_ids, cum_weights, lesson_ids = context['course_ids'], context['cum_weights'], context['lesson_ids']
+    now = timezone.now()
+    payments, history = [], []
+    for number in range(start, stop):
+        user_id = context['user_ids'][number]
+        for index in range(geometric(rng, context['payments_per_user'])):
+            course_id = lesson_id = None
+            if lesson_ids and rng.random() < context['lesson_payment_share']:
+                lesson_id = lesson_ids[rng.randrange(len(lesson_ids))]
+                amount = Decimal(500)
+            else:
+                rank = rng.choices(range(len(course_ids)), cum_weights=cum_weights)[0]
+                course_id = course_ids[rank]
+                amount = Decimal(1000 * (rank % 10 + 1))
+            method = rng.choices(PAYMENT_METHODS, weights=PAYMENT_METHOD_WEIGHTS)[0]
+            # Свежих платежей больше, чем старых
+            payment_date = now - timedelta(days=min(rng.expovariate(3 / context['days']), context['days']))
+            is_paid = rng.random() < context['paid_share']
+            payments.append(Payment(
+                user_id=user_id,
+                course_id=course_id,
+                lesson_id=lesson_id,
+                amount=amount,
+                payment_method=method,
+                payment_date=payment_date,
+                is_paid=is_paid,
+                stripe_session_id=f'cs_synthetic_{context["seed"]}_{number}_{index}',
+                stripe_status='complete' if is_paid else 'open',
+            ))
+            if is_paid:
+                history.append(UserPayment(
+                    user_id=user_id,
+                    paid_course_id=course_id,
+                    paid_lesson_id=lesson_id,
+                    amount=amount,
+                    payment_method=method,
+                    payment_date=payment_date,
+                ))
+
+    with historical_dates(Payment._meta.get_field('payment_date'), UserPayment._meta.get_field('payment_date')):
+        Payment.objects.bulk_create(payments, batch_size=context['batch_size'])
+        UserPayment.objects.bulk_create(history, batch_size=context['batch_size'])
+    return len(payments) + len(history)
+
+
+PHASES = {
+    'users': create_users,
+    'courses': create_courses,
+    'lessons': create_lessons,
+    'subscriptions': create_subscriptions,
+    'payments': create_payments,
+}
+
+
+class SyntheticDataGenerator:
+    """
+    Генератор пользователей, курсов, уроков, подписок и платежей.
+    Каждый этап делится на пачки, которые параллельно записывают процессы-исполнители
+    """
+
+    def __init__(self, seed=42, users=1000, owner_share=0.05, courses_per_owner=5, lessons_per_course=10,
+                 subscriptions_per_user=3, payments_per_user=2, lesson_payment_share=0.2, paid_share=0.8,
+                 days=365, skew=1.1, batch_size=5000, workers=1, report=None):
+        self.options = {
+            'seed': seed,
+            'days': days,
+            'batch_size': batch_size,
+            'courses_per_owner': courses_per_owner,
+            'lessons_per_course': lessons_per_course,
+            'subscriptions_per_user': subscriptions_per_user,
+            'payments_per_user': payments_per_user,
+            'lesson_payment_share': lesson_payment_share,
+            'paid_share': paid_share,
+        }
+        self.users = users
+        self.owners = max(1, int(users * owner_share)) if courses_per_owner else 0
+        self.skew = skew
+        # SQLite не допускает параллельной записи, поэтому пачки пишутся в текущем процессе
+        self.workers = 1 if connection.vendor == 'sqlite' else max(1, workers)
+        self.report = report or (lambda message: None)
+        self.stats = {}
+
+    def run_phase(self, phase, total, **context):
+        context = {**self.options, **context}
+        tasks = [(phase, start, stop) for start, stop in chunk_ranges(total, self.options['batch_size'])]
+        started = time.monotonic()
+        if self.workers == 1 or len(tasks) <= 1:
+            _init_worker(context)
+            created = sum(map(_run_chunk, tasks))
+        else:
+            # Соединения родителя не должны наследоваться процессами-исполнителями
+            connections.close_all()
+            with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(context,)) as pool:
+                created = sum(pool.imap_unordered(_run_chunk, tasks))
+        elapsed = time.monotonic() - started
+        self.stats[phase] = created
+        self.report(f'{phase}: {created} строк за {elapsed:.1f} с ({created / max(elapsed, 1e-6):.0f} строк/с)')
+
+    @staticmethod
+    def ids(queryset, *fields):
+        # Компактные массивы вместо списков: миллионы id занимают десятки мегабайт
+        columns = [array('q') for _ in fields]
+        for row in queryset.values_list(*fields).iterator(chunk_size=10000):
+            for column, value in zip(columns, row):
+                column.append(value)
+        return columns
+
+    def run(self):
+        from users.models import User
+        from .models import Course, Lesson
+
+        seed = self.options['seed']
+        prefix = f'synthetic-{seed}-'
+
+        self.run_phase('users', self.users, password=make_password(SYNTHETIC_PASSWORD))
+        users = User.objects.filter(email__startswith=prefix).order_by('email')
+        user_ids, = self.ids(users, 'id')
+
+        self.run_phase('courses', self.owners * self.options['courses_per_owner'], owner_ids=user_ids[:self.owners])
+        courses = Course.objects.filter(owner__email__startswith=prefix).order_by('title')
+        course_ids, course_owner_ids = self.ids(courses, 'id', 'owner_id')
+
+        self.run_phase('lessons', len(course_ids), course_ids=course_ids, course_owner_ids=course_owner_ids)
+        lessons = Lesson.objects.filter(course__owner__email__startswith=prefix).order_by('course__title', 'title')
+        lesson_ids, = self.ids(lessons, 'id')
+
+        if course_ids:
+            cum_weights = zipf_cum_weights(len(course_ids), self.skew)
+            self.run_phase('subscriptions', len(user_ids), user_ids=user_ids, course_ids=course_ids,
+                           cum_weights=cum_weights)
+            self.run_phase('payments', len(user_ids), user_ids=user_ids, course_ids=course_ids,
+                           cum_weights=cum_weights, lesson_ids=lesson_ids)
+        return self.stats
@@ -1,78 +1,239 @@
-from celery import shared_task
-from django.core.mail import send_mail
+import logging
+import time
+from itertools import groupby
+
+from celery import chord, shared_task
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 from django.utils import timezone
-from datetime import timedelta
-from .models import Course, Subscription
+from .digest import changed_courses, mark_processed, pending_windows, processing_lock
+from .models import Payment, StripeWebhookEvent, Subscription
+from .services import PaymentService, StripeService
+from .stripe_client import StripeUnavailable
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def send_course_update_notification(course_id):
+# Время создания (timestamp), начиная с которого сверяются сессии Stripe
+RECONCILE_HIGH_WATER_MARK_KEY = 'materials:stripe:reconcile:created'
+
+
+def subscriber_ranges(course_ids, chunk_size):
     """
-    Отправка уведомлений об обновлении курса подписанным пользователям
+    Границы (первый id, последний id) пачек пользователей, подписанных на любой из курсов
+    """
+    last_id = 0
+    while True:
+        ids = list(
+            Subscription.objects.filter(course_id__in=course_ids, user_id__gt=last_id)
+            .order_by('user_id')
+            .values_list('user_id', flat=True)
+            .distinct()[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids[0], ids[-1]
+        last_id = ids[-1]
+
+
+def dispatch_chunks(header, label):
     """
+    Запускает пачки параллельно, итоги собирает report_notification_results
+    """
+    if not header:
+        return 0
+    chord(header)(report_notification_results.s(label))
+    return len(header)
+
+
+def send_letters(task, letters):
+    """
+    Отправляет письма (email, тема, текст) через одно SMTP-соединение.
+    Ошибка отдельного письма не прерывает отправку остальных
+    """
+    connection = get_connection(fail_silently=False)
     try:
-        course = Course.objects.get(id=course_id)
-        subscriptions = Subscription.objects.filter(course=course)
-
-        for subscription in subscriptions:
-            send_mail(
-                subject=f'Обновление курса: {course.title}',
-                message=f'Уважаемый(ая) {subscription.user.email}!\n\n'
-                        f'Курс "{course.title}" был обновлен. '
-                        f'Загляните, чтобы ознакомиться с новыми материалами!\n\n'
-                        f'С уважением, команда образовательной платформы',
+        connection.open()
+    except Exception as e:
+        # Почтовый сервер недоступен: повторяем пачку целиком
+        raise task.retry(exc=e)
+
+    sent = 0
+    failed = []
+    try:
+        for email, subject, body in letters:
+            letter = EmailMessage(
+                subject=subject,
+                body=body,
                 from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[subscription.user.email],
-                fail_silently=False,
+                to=[email],
+                connection=connection,
             )
+            try:
+                sent += letter.send()
+            except Exception as e:
+                logger.warning('Не удалось отправить уведомление %s: %s', email, e)
+                failed.append(email)
+    finally:
+        connection.close()
+    return sent, failed
 
-        return f"Уведомления отправлены для курса {course.title}"
 
-    except Course.DoesNotExist:
-        return f"Курс с ID {course_id} не найден"
-    except Exception as e:
-        return f"Ошибка при отправке уведомлений: {str(e)}"
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_digest_chunk(self, course_ids, first_user_id, last_user_id):
+    """
+    Отправка дайджестов пачке подписчиков: одно письмо со всеми обновленными курсами пользователя
+    """
+    rows = Subscription.objects.filter(
+        course_id__in=course_ids,
+        user_id__gte=first_user_id,
+        user_id__lte=last_user_id
+    ).order_by('user_id', 'course__title').values_list('user__email', 'course__title')
+
+    def letters():
+        for email, group in groupby(rows, key=lambda row: row[0]):
+            titles = '\n'.join(f'- {title}' for _, title in group)
+            yield (
+                email,
+                'Обновления курсов',
+                f'Уважаемый(ая) {email}!\n\n'
+                f'С момента прошлого письма обновились курсы, на которые вы подписаны:\n{titles}\n\n'
+                f'С уважением, команда образовательной платформы'
+            )
+
+    sent, failed = send_letters(self, letters())
+
+    logger.info(
+        'Дайджест, пользователи %s-%s: отправлено %s, ошибок %s',
+        first_user_id, last_user_id, sent, len(failed)
+    )
+    return {'first_id': first_user_id, 'last_id': last_user_id, 'sent': sent, 'failed': failed}
 
 
 @shared_task
-def send_lesson_update_notification(lesson_id, course_id):
+def report_notification_results(results, label):
     """
-    Отправка уведомлений об обновлении урока (с проверкой времени)
+    Итог рассылки по всем пачкам
     """
-    try:
-        course = Course.objects.get(id=course_id)
+    sent = sum(result['sent'] for result in results)
+    failed = [email for result in results for email in result['failed']]
+    if failed:
+        logger.warning('%s: не доставлено %s уведомлений', label, len(failed))
+    return f"{label}: отправлено {sent} уведомлений в {len(results)} пачках, ошибок {len(failed)}"
+
+
+@shared_task
+def send_course_update_digests():
+    """
+    Периодическая отправка дайджестов по курсам, изменившимся в закрытых окнах
+    """
+    with processing_lock() as acquired:
+        if not acquired:
+            return "Дайджесты уже обрабатываются другим запуском"
 
-        # Проверяем, когда курс обновлялся последний раз
-        time_threshold = timezone.now() - timedelta(hours=4)
+        windows = pending_windows()
+        if not windows:
+            return "Нет закрытых окон для обработки"
 
-        # Если курс обновлялся менее 4 часов назад, не отправляем уведомление
-        if course.updated_at and course.updated_at > time_threshold:
-            return f"Курс обновлялся недавно, уведомление не отправлено"
+        course_ids = set()
+        for window in windows:
+            course_ids |= changed_courses(window)
 
-        # Отправляем уведомления подписанным пользователям
-        subscriptions = Subscription.objects.filter(course=course)
+        header = [
+            send_digest_chunk.s(sorted(course_ids), first_id, last_id)
+            for first_id, last_id in subscriber_ranges(course_ids, settings.NOTIFICATION_CHUNK_SIZE)
+        ] if course_ids else []
+        chunks = dispatch_chunks(header, 'Дайджест')
+        mark_processed(windows[-1])
 
-        for subscription in subscriptions:
-            send_mail(
-                subject=f'Новый урок в курсе: {course.title}',
-                message=f'Уважаемый(ая) {subscription.user.email}!\n\n'
-                        f'В курсе "{course.title}" добавлен новый урок. '
-                        f'Не пропустите новые знания!\n\n'
-                        f'С уважением, команда образовательной платформы',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[subscription.user.email],
-                fail_silently=False,
-            )
+    return f"Дайджесты по {len(course_ids)} курсам поставлены в очередь ({chunks} пачек)"
 
-        # Обновляем время последнего обновления курса
-        course.updated_at = timezone.now()
-        course.save()
 
-        return f"Уведомления об уроке отправлены для курса {course.title}"
+@shared_task(bind=True, max_retries=3, default_retry_delay=10)
+def create_checkout_session(self, payment_id):
+    """
+    Создание сессии оплаты в Stripe для отложенного платежа
+    """
+    try:
+        payment = Payment.objects.select_related('user', 'course', 'lesson').get(
+            pk=payment_id,
+            checkout_status=Payment.CHECKOUT_PENDING
+        )
+    except Payment.DoesNotExist:
+        return f"Платеж {payment_id} не ожидает создания сессии оплаты"
 
-    except Course.DoesNotExist:
-        return f"Курс с ID {course_id} не найден"
+    try:
+        PaymentService.complete_checkout(payment)
+        return f"Сессия оплаты для платежа {payment_id} создана"
+    except StripeUnavailable as e:
+        # Stripe недоступен: пробуем позже, пока не исчерпаны повторы
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        error = str(e.detail)
     except Exception as e:
-        return f"Ошибка при отправке уведомлений: {str(e)}"
+        error = str(e)
+
+    Payment.objects.filter(pk=payment_id).update(
+        checkout_status=Payment.CHECKOUT_FAILED,
+        checkout_error=error
+    )
+    return f"Ошибка создания сессии оплаты для платежа {payment_id}: {error}"
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30)
+def process_stripe_session_event(self, event_id, session_id, session_status, payment_status):
+    """
+    Обработка события Stripe о сессии оплаты.
+    Событие отмечается обработанным только после применения статуса
+    """
+    try:
+        paid = PaymentService.apply_session_status(session_id, session_status, payment_status)
+    except Exception as e:
+        # Необработанное событие повторит задача или повторная доставка от Stripe
+        raise self.retry(exc=e)
+    StripeWebhookEvent.objects.filter(event_id=event_id).update(processed_at=timezone.now())
+    return f"Событие {event_id}: сессия {session_id} в статусе {session_status}, оплачено платежей {paid}"
+
+
+@shared_task
+def reconcile_stripe_payments():
+    """
+    Сверка платежей с сессиями Stripe через постраничный список сессий.
+    Каждый запуск начинает с отметки: самой старой еще открытой сессии прошлого запуска
+    """
+    high_water_mark = cache.get(RECONCILE_HIGH_WATER_MARK_KEY)
+    if high_water_mark is None:
+        high_water_mark = int(time.time()) - settings.PAYMENT_RECONCILE_LOOKBACK
+
+    batch_size = settings.PAYMENT_RECONCILE_BATCH_SIZE
+    newest = high_water_mark
+    oldest_open = None
+    sessions = {}
+    changed = paid = seen = 0
+
+    def flush():
+        nonlocal changed, paid
+        batch_changed, batch_paid = PaymentService.reconcile_sessions(sessions)
+        changed += batch_changed
+        paid += batch_paid
+        sessions.clear()
+
+    try:
+        for session in StripeService.list_sessions(high_water_mark, page_size=batch_size):
+            seen += 1
+            newest = max(newest, session.created)
+            if session.status == 'open':
+                # Открытая сессия еще может быть оплачена: следующий запуск начнется с нее
+                oldest_open = min(oldest_open or session.created, session.created)
+            sessions[session.id] = session
+            if len(sessions) >= batch_size:
+                flush()
+        if sessions:
+            flush()
+    except (StripeUnavailable, ValidationError) as e:
+        # Отметку не сдвигаем: следующий запуск повторит сверку
+        return f"Ошибка сверки платежей: {e}"
 
+    cache.set(RECONCILE_HIGH_WATER_MARK_KEY, oldest_open or newest, timeout=None)
+    return f"Проверено {seen} сессий, изменено {changed} платежей, оплачено {paid}"
@@ -5,13 +5,20 @@ from .views import (
     LessonListCreateAPIView,
     LessonRetrieveAPIView,
     LessonUpdateAPIView,
+    LessonBulkAPIView,
     LessonDestroyAPIView,
     SubscriptionAPIView,
+    SubscriptionBulkAPIView,
     PaymentCreateAPIView,
     PaymentStatusAPIView,
     PaymentListAPIView,
+    PaymentDetailAPIView,
     PaymentSuccessAPIView,
     PaymentCancelAPIView,
+    StripeMetricsAPIView,
+    RevenueReportAPIView,
+    PaymentExportAPIView,
+    StripeWebhookAPIView,
 )
 
 router = DefaultRouter()
@@ -20,15 +27,22 @@ router.register(r'courses', CourseViewSet, basename='courses')
 urlpatterns = [
     path('', include(router.urls)),
     path('lessons/', LessonListCreateAPIView.as_view(), name='lesson-list-create'),
+    path('lessons/bulk/', LessonBulkAPIView.as_view(), name='lesson-bulk'),
     path('lessons/<int:pk>/', LessonRetrieveAPIView.as_view(), name='lesson-detail'),
     path('lessons/<int:pk>/update/', LessonUpdateAPIView.as_view(), name='lesson-update'),
     path('lessons/<int:pk>/delete/', LessonDestroyAPIView.as_view(), name='lesson-delete'),
     path('subscriptions/', SubscriptionAPIView.as_view(), name='subscription'),
+    path('subscriptions/bulk/', SubscriptionBulkAPIView.as_view(), name='subscription-bulk'),
 
     # Платежи
     path('payments/create/', PaymentCreateAPIView.as_view(), name='payment-create'),
     path('payments/status/', PaymentStatusAPIView.as_view(), name='payment-status'),
     path('payments/history/', PaymentListAPIView.as_view(), name='payment-list'),
+    path('payments/<int:pk>/', PaymentDetailAPIView.as_view(), name='payment-detail'),
     path('payments/success/', PaymentSuccessAPIView.as_view(), name='payment-success'),
     path('payments/cancel/', PaymentCancelAPIView.as_view(), name='payment-cancel'),
+    path('payments/reports/revenue/', RevenueReportAPIView.as_view(), name='revenue-report'),
+    path('payments/export/', PaymentExportAPIView.as_view(), name='payment-export'),
+    path('payments/webhook/', StripeWebhookAPIView.as_view(), name='stripe-webhook'),
+    path('payments/stripe-metrics/', StripeMetricsAPIView.as_view(), name='stripe-metrics'),
 ]
\ No newline at end of file
@@ -1,33 +1,135 @@
+from collections import Counter
+from functools import partial
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Prefetch
+from django.http import StreamingHttpResponse
+from django.urls import reverse
 from rest_framework import viewsets, generics, permissions, status
-from rest_framework.generics import ListAPIView
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .tasks import send_course_update_notification, send_lesson_update_notification
-
-from .models import Course, Lesson, Subscription, Payment
-from .paginators import CoursePagination, LessonPagination
-from .serializers import CourseSerializer, LessonSerializer, SubscriptionSerializer, PaymentCreateSerializer, \
-    PaymentStatusSerializer, PaymentSerializer
+from users.authentication import ClaimsJWTAuthentication
+from users.roles import is_moderator
+
+from .counters import COUNTER_FIELDS, adjust_counter
+from .digest import record_course_change
+from .idempotency import IdempotentMixin
+
+from .cache import COURSES_VERSION, LESSONS_VERSION, CachedResponseMixin, ConditionalGetMixin, bump_versions, \
+    subscriptions_version
+from .exports import payment_csv_rows
+from .filters import PaymentDailyRollupFilter, PaymentExportFilter
+from .models import Course, Lesson, Subscription, Payment, PaymentDailyRollup, StripeWebhookEvent
+from .paginators import CoursePagination, LessonPagination, PaymentPagination, ReportPagination
+from .serializers import CourseSerializer, LessonSerializer, LessonBulkSerializer, SubscriptionSerializer, \
+    PaymentCreateSerializer, PaymentStatusSerializer, PaymentSerializer, PaymentCheckoutSerializer, \
+    PaymentDailyRollupSerializer, SubscriptionBulkSerializer
 from .permissions import IsOwnerOrModerator, IsModerator, IsOwner
 from .services import PaymentService
+from .tasks import create_checkout_session, process_stripe_session_event
+from .stripe_client import StripeUnavailable, request_budget, stripe_breaker
+from .subscriptions import subscribe, unsubscribe
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = CourseSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = CoursePagination
+    # Сортировка по популярности: ?ordering=-subscribers_count
+    ordering_fields = ['id', 'title', 'updated_at', 'lessons_count', 'subscribers_count', 'purchases_count']
+    cache_resource = 'courses'
+    cache_per_user = True
 
-    def get_queryset(self):
+    def get_cache_versions(self):
+        return [COURSES_VERSION, subscriptions_version(self.request.user.pk)]
+
+    def list(self, request, *args, **kwargs):
+        handler = partial(self.conditional_response, super().list)
+        return self.cached_response(handler, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = partial(self.conditional_response, super().retrieve)
+        return self.cached_response(handler, request, *args, **kwargs)
+
+    def get_conditional_validators(self, request, *args, **kwargs):
+        """
+        Состояние курсов страницы (или одного курса), их уроков и подписок пользователя.
+        Запросы затрагивают только курсы ответа, поэтому не зависят от размера каталога
+        """
+        extra = []
+        if self.action == 'retrieve':
+            try:
+                course_ids = [int(kwargs[self.lookup_url_kwarg or self.lookup_field])]
+            except (TypeError, ValueError):
+                # Некорректный id: get_object() вернет 404
+                return None
+        else:
+            # Страница выбирается один раз: list() загрузит ее курсы по сохраненным id
+            page = self.paginate_queryset(self.filter_queryset(self.get_visible_queryset()))
+            course_ids = self.page_course_ids = [course.id for course in page]
+            extra = self.get_page_state()
+
+        courses = list(
+            self.get_visible_queryset().filter(pk__in=course_ids)
+            .annotate(lessons_updated=Max('lessons__updated_at'))
+            .order_by('pk').values_list('id', 'updated_at', 'lessons_updated', *COUNTER_FIELDS)
+        )
+        if self.action == 'retrieve' and not courses:
+            return None
+        subscriptions = list(
+            Subscription.objects.filter(user_id=request.user.pk, course_id__in=course_ids)
+            .order_by('course_id').values_list('course_id', 'subscribed_at')
+        )
+
+        # updated_at курса и последнего измененного урока, время подписки
+        timestamps = [value for row in courses for value in row[1:3]]
+        timestamps += [subscribed_at for _, subscribed_at in subscriptions]
+        last_modified = max(filter(None, timestamps), default=None)
+        etag_source = ':'.join(str(value) for value in [
+            self.get_cache_scope(), request.get_full_path(), *extra, courses, subscriptions,
+        ])
+        return etag_source, last_modified
+
+    def get_page_state(self):
+        """
+        Общее число курсов (постраничный режим) или ссылки на соседние страницы (курсорный режим)
+        """
+        if self.paginator.cursor_paginator is not None:
+            cursor = self.paginator.cursor_paginator
+            return [cursor.get_next_link(), cursor.get_previous_link()]
+        return [self.paginator.page.paginator.count]
+
+    def paginate_queryset(self, queryset):
+        page_course_ids = getattr(self, 'page_course_ids', None)
+        if page_course_ids is None:
+            return super().paginate_queryset(queryset)
+        # Страница уже выбрана при вычислении ETag, состояние пагинатора сохранено
+        courses = queryset.in_bulk(page_course_ids)
+        return [courses[course_id] for course_id in page_course_ids if course_id in courses]
+
+    def get_visible_queryset(self):
         user = self.request.user
-        if user.is_authenticated and user.groups.filter(name='moderators').exists():
+        if user.is_authenticated and is_moderator(user):
             # Модераторы видят все курсы
             return Course.objects.all()
         elif user.is_authenticated:
             # Обычные пользователи видят только свои курсы
-            return Course.objects.filter(owner=user)
+            return Course.objects.filter(owner_id=user.pk)
         return Course.objects.none()
 
+    def get_queryset(self):
+        # Владельцы и вложенные уроки загружаются заранее,
+        # чтобы число запросов не зависело от размера страницы
+        return self.get_visible_queryset().select_related('owner').prefetch_related(
+            Prefetch('lessons', queryset=Lesson.objects.select_related('owner'))
+        )
+
     def get_permissions(self):
         if self.action == 'create':
             # Создавать курсы могут только авторизованные пользователи (не модераторы)
@@ -40,35 +142,49 @@ class CourseViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
-        if self.request.user.groups.filter(name='moderators').exists():
-            from rest_framework.exceptions import PermissionDenied
+        if is_moderator(self.request.user):
             raise PermissionDenied("Модераторы не могут создавать курсы")
         serializer.save(owner=self.request.user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
+        user = self.request.user
+        if self.action in ['list', 'retrieve'] and user.is_authenticated:
+            # Подписки пользователя получаем одним запросом на весь ответ
+            context['subscribed_course_ids'] = set(
+                Subscription.objects.filter(user_id=user.pk).values_list('course_id', flat=True)
+            )
         return context
 
     def perform_update(self, serializer):
         instance = serializer.save()
-        # Асинхронная отправка уведомлений об обновлении курса
-        send_course_update_notification.delay(instance.id)
+        # Подписчики получат одно письмо-дайджест по всем изменениям за окно
+        record_course_change(instance.id)
 
 
-class LessonListCreateAPIView(generics.ListCreateAPIView):
+class LessonListCreateAPIView(CachedResponseMixin, generics.ListCreateAPIView):
     serializer_class = LessonSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     pagination_class = LessonPagination
+    cache_resource = 'lessons'
+
+    def get_cache_versions(self):
+        return [LESSONS_VERSION]
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='moderators').exists():
+        if is_moderator(user):
             # Модераторы видят все уроки
-            return Lesson.objects.all()
+            queryset = Lesson.objects.all()
         else:
             # Обычные пользователи видят только свои уроки
-            return Lesson.objects.filter(owner=user)
+            queryset = Lesson.objects.filter(owner_id=user.pk)
+        return queryset.select_related('owner')
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -77,21 +193,36 @@ class LessonListCreateAPIView(generics.ListCreateAPIView):
         return [permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
-        if self.request.user.groups.filter(name='moderators').exists():
-            from rest_framework.exceptions import PermissionDenied
+        if is_moderator(self.request.user):
             raise PermissionDenied("Модераторы не могут создавать уроки")
         serializer.save(owner=self.request.user)
 
 
-class LessonRetrieveAPIView(generics.RetrieveAPIView):
+class LessonRetrieveAPIView(ConditionalGetMixin, CachedResponseMixin, generics.RetrieveAPIView):
     serializer_class = LessonSerializer
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrModerator]
+    cache_resource = 'lessons'
+
+    def get_cache_versions(self):
+        return [LESSONS_VERSION]
+
+    def retrieve(self, request, *args, **kwargs):
+        handler = partial(self.conditional_response, super().retrieve)
+        return self.cached_response(handler, request, *args, **kwargs)
+
+    def get_conditional_validators(self, request, *args, **kwargs):
+        lesson_id = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        updated_at = self.get_queryset().filter(pk=lesson_id).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        return f'{self.get_cache_scope()}:{lesson_id}:{updated_at}', updated_at
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='moderators').exists():
-            return Lesson.objects.all()
-        return Lesson.objects.filter(owner=user)
+        if is_moderator(user):
+            return Lesson.objects.select_related('owner')
+        return Lesson.objects.filter(owner_id=user.pk).select_related('owner')
 
 
 class LessonUpdateAPIView(generics.UpdateAPIView):
@@ -100,14 +231,91 @@ class LessonUpdateAPIView(generics.UpdateAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        if user.groups.filter(name='moderators').exists():
-            return Lesson.objects.all()
-        return Lesson.objects.filter(owner=user)
+        if is_moderator(user):
+            return Lesson.objects.select_related('owner')
+        return Lesson.objects.filter(owner_id=user.pk).select_related('owner')
 
     def perform_update(self, serializer):
         instance = serializer.save()
-        # Асинхронная отправка уведомлений об обновлении урока
-        send_lesson_update_notification.delay(instance.id, instance.course.id)
+        # Изменение урока попадает в дайджест курса
+        record_course_change(instance.course_id)
+
+
+class LessonBulkAPIView(APIView):
+    """
+    Массовое создание (POST) и изменение (PATCH) уроков списком.
+    Список проверяется целиком и записывается в одной транзакции,
+    а каждый затронутый курс попадает в дайджест один раз
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        if is_moderator(user):
+            return Lesson.objects.all()
+        return Lesson.objects.filter(owner_id=user.pk)
+
+    def get_serializer(self, *args, **kwargs):
+        return LessonBulkSerializer(
+            *args,
+            many=True,
+            allow_empty=False,
+            max_length=settings.LESSON_BULK_MAX_SIZE,
+            context={'request': self.request},
+            **kwargs
+        )
+
+    @staticmethod
+    def requested_ids(data):
+        ids = set()
+        for item in data if isinstance(data, list) else []:
+            try:
+                ids.add(int(item.get('id')))
+            except (AttributeError, TypeError, ValueError):
+                continue
+        return ids
+
+    def post(self, request):
+        if is_moderator(request.user):
+            raise PermissionDenied("Модераторы не могут создавать уроки")
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save(owner=request.user)
+            # bulk_create не вызывает сигналы, поэтому счетчики обновляем явно
+            adjust_counter('lessons_count', Counter(lesson.course_id for lesson in lessons))
+
+        self.lessons_changed({lesson.course_id for lesson in lessons})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def patch(self, request):
+        # Уроки, недоступные пользователю, считаются ненайденными
+        lessons = list(self.get_queryset().filter(pk__in=self.requested_ids(request.data)))
+        previous = {lesson.pk: lesson.course_id for lesson in lessons}
+
+        serializer = self.get_serializer(lessons, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            lessons = serializer.save()
+            # Перенос уроков между курсами: bulk_update не вызывает сигналы
+            deltas = Counter()
+            for lesson in lessons:
+                if previous[lesson.pk] != lesson.course_id:
+                    deltas[previous[lesson.pk]] -= 1
+                    deltas[lesson.course_id] += 1
+            adjust_counter('lessons_count', deltas)
+
+        self.lessons_changed(
+            {lesson.course_id for lesson in lessons} | {previous[lesson.pk] for lesson in lessons}
+        )
+        return Response(serializer.data)
+
+    @staticmethod
+    def lessons_changed(course_ids):
+        bump_versions(COURSES_VERSION, LESSONS_VERSION)
+        for course_id in course_ids:
+            record_course_change(course_id)
 
 
 class LessonDestroyAPIView(generics.DestroyAPIView):
@@ -127,7 +335,9 @@ class SubscriptionAPIView(APIView):
 
     def post(self, request):
         """
-        Создание или удаление подписки
+        Создание или удаление подписки.
+        Удаление выполняется первым и само служит проверкой существования подписки,
+        вставка проверяет существование курса тем же запросом
         """
         user = request.user
         course_id = request.data.get('course_id')
@@ -139,46 +349,80 @@ class SubscriptionAPIView(APIView):
             )
 
         try:
-            course = Course.objects.get(id=course_id)
-        except Course.DoesNotExist:
+            course_id = int(course_id)
+        except (TypeError, ValueError):
             return Response(
-                {"error": "Курс не найден"},
-                status=status.HTTP_404_NOT_FOUND
+                {"error": "course_id должен быть числом"},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Проверяем существующую подписку
-        subscription = Subscription.objects.filter(
-            user=user,
-            course=course
-        ).first()
-
-        if subscription:
-            # Удаляем подписку
-            subscription.delete()
+        # Удаляем подписку, если она была
+        if unsubscribe(user.pk, [course_id]):
             return Response(
                 {"message": "Подписка удалена"},
                 status=status.HTTP_204_NO_CONTENT
             )
+
+        # Создаем подписку
+        created = subscribe(user.pk, [course_id])
+        if created:
+            subscription = created[0]
         else:
-            # Создаем подписку
-            subscription = Subscription.objects.create(
-                user=user,
-                course=course
-            )
-            serializer = SubscriptionSerializer(subscription)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
+            # Курса нет, либо параллельный запрос успел создать ту же подписку
+            subscription = Subscription.objects.filter(user=user, course_id=course_id).first()
+            if subscription is None:
+                return Response(
+                    {"error": "Курс не найден"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+
+        serializer = SubscriptionSerializer(subscription)
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED
+        )
+
+
+class SubscriptionBulkAPIView(APIView):
+    """
+    Подписка или отписка сразу от нескольких курсов
+    """
+    permission_classes = [permissions.IsAuthenticated]
 
+    def post(self, request):
+        serializer = SubscriptionBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        course_ids = set(serializer.validated_data['course_ids'])
+
+        if serializer.validated_data['action'] == SubscriptionBulkSerializer.UNSUBSCRIBE:
+            return Response({'unsubscribed': len(unsubscribe(user.pk, course_ids))})
+
+        existing = set(Course.objects.filter(id__in=course_ids).values_list('id', flat=True))
+        # Счетчики увеличиваются только по действительно вставленным строкам
+        subscribe(user.pk, existing)
+
+        return Response({
+            'subscribed': sorted(existing),
+            'not_found': sorted(course_ids - existing),
+        })
 
-class PaymentCreateAPIView(APIView):
+
+class PaymentCreateAPIView(IdempotentMixin, APIView):
     """
-    Создание платежа и получение ссылки на оплату
+    Создание платежа и получение ссылки на оплату.
+    Поддерживает заголовок Idempotency-Key для безопасных повторов
     """
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
+        return self.idempotent_response(self.create_payment, request)
+
+    def get_idempotency_lock_timeout(self):
+        # Продукт, цена и сессия оплаты: три запроса к Stripe со всеми повторами
+        return max(super().get_idempotency_lock_timeout(), request_budget(calls=3))
+
+    def create_payment(self, request, idempotency_key=None):
         serializer = PaymentCreateSerializer(data=request.data)
         if serializer.is_valid():
             try:
@@ -209,16 +453,38 @@ class PaymentCreateAPIView(APIView):
                             status=status.HTTP_404_NOT_FOUND
                         )
 
+                if settings.PAYMENT_ASYNC_CHECKOUT:
+                    # Сохраняем платеж и сразу отвечаем, сессию оплаты создает фоновая задача
+                    payment = PaymentService.create_pending_payment(
+                        user=request.user,
+                        course=course,
+                        lesson=lesson,
+                        amount=amount
+                    )
+                    transaction.on_commit(lambda: create_checkout_session.delay(payment.id))
+                    return Response(
+                        {
+                            'payment_id': payment.id,
+                            'checkout_status': payment.checkout_status,
+                            'amount': payment.amount
+                        },
+                        status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': reverse('payment-detail', args=[payment.id])}
+                    )
+
                 # Создаем платеж и получаем ссылку на оплату
                 payment_data = PaymentService.create_payment_intent(
                     user=request.user,
                     course=course,
                     lesson=lesson,
-                    amount=amount
+                    amount=amount,
+                    idempotency_key=idempotency_key
                 )
 
                 return Response(payment_data, status=status.HTTP_201_CREATED)
 
+            except StripeUnavailable as e:
+                return Response({'error': e.detail}, status=e.status_code)
             except Exception as e:
                 return Response(
                     {'error': str(e)},
@@ -247,6 +513,8 @@ class PaymentStatusAPIView(APIView):
             status_data = PaymentService.check_payment_status(session_id)
             serializer = PaymentStatusSerializer(status_data)
             return Response(serializer.data)
+        except StripeUnavailable as e:
+            return Response({'error': e.detail}, status=e.status_code)
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -260,6 +528,18 @@ class PaymentListAPIView(ListAPIView):
     """
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
+    pagination_class = PaymentPagination
+
+    def get_queryset(self):
+        return Payment.objects.filter(user=self.request.user).select_related('user', 'course', 'lesson')
+
+
+class PaymentDetailAPIView(RetrieveAPIView):
+    """
+    Статус создания сессии и ссылка на оплату по id платежа, без обращения к Stripe
+    """
+    serializer_class = PaymentCheckoutSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         return Payment.objects.filter(user=self.request.user)
@@ -274,11 +554,14 @@ class PaymentSuccessAPIView(APIView):
         session_id = request.GET.get('session_id')
         if session_id:
             try:
-                status_data = PaymentService.check_payment_status(session_id)
+                # Редирект от Stripe может опередить вебхук
+                status_data = PaymentService.check_payment_status(session_id, confirm=True)
                 return Response({
                     'message': 'Оплата прошла успешно!',
                     'status': status_data
                 })
+            except StripeUnavailable as e:
+                return Response({'error': e.detail}, status=e.status_code)
             except Exception as e:
                 return Response({
                     'error': f'Ошибка при проверке платежа: {str(e)}'
@@ -299,3 +582,93 @@ class PaymentCancelAPIView(APIView):
             'message': 'Оплата была отменена. Вы можете попробовать снова.'
         }, status=status.HTTP_200_OK)
 
+
+class RevenueReportAPIView(ListAPIView):
+    """
+    Отчет о выручке по дням из предвычисленной сводки.
+    Фильтры: date_from, date_to, course, lesson, payment_method
+    """
+    serializer_class = PaymentDailyRollupSerializer
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = ReportPagination
+    filterset_class = PaymentDailyRollupFilter
+    ordering_fields = ['day', 'revenue', 'payments_count']
+    queryset = PaymentDailyRollup.objects.select_related('course', 'lesson')
+
+
+class PaymentExportAPIView(APIView):
+    """
+    Выгрузка платежей в CSV потоком, без загрузки всей выборки в память.
+    Фильтры: date_from, date_to, payment_method, is_paid
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        filterset = PaymentExportFilter(request.query_params, queryset=Payment.objects.all())
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(
+            payment_csv_rows(filterset.qs, chunk_size=settings.PAYMENT_EXPORT_CHUNK_SIZE),
+            content_type='text/csv; charset=utf-8'
+        )
+        response['Content-Disposition'] = 'attachment; filename="payments.csv"'
+        return response
+
+
+class StripeWebhookAPIView(APIView):
+    """
+    Прием подписанных событий Stripe о сессиях оплаты.
+    Событие считается обработанным только после успешного выполнения задачи,
+    поэтому повторная доставка необработанного события снова ставит его в очередь
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    handled_events = {
+        'checkout.session.completed',
+        'checkout.session.async_payment_succeeded',
+        'checkout.session.async_payment_failed',
+        'checkout.session.expired',
+    }
+
+    def post(self, request):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            return Response(
+                {'error': 'Вебхуки Stripe не настроены'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        try:
+            event = stripe.Webhook.construct_event(
+                request.body,
+                request.META.get('HTTP_STRIPE_SIGNATURE', ''),
+                settings.STRIPE_WEBHOOK_SECRET
+            )
+        except (ValueError, stripe.SignatureVerificationError):
+            return Response(
+                {'error': 'Неверная подпись события'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if event['type'] in self.handled_events:
+            webhook_event, _ = StripeWebhookEvent.objects.get_or_create(
+                event_id=event['id'],
+                defaults={'event_type': event['type']}
+            )
+            if webhook_event.processed_at is None:
+                session = event['data']['object']
+                transaction.on_commit(lambda: process_stripe_session_event.delay(
+                    event['id'], session['id'], session['status'], session['payment_status']
+                ))
+
+        return Response({'received': True})
+
+
+class StripeMetricsAPIView(APIView):
+    """
+    Состояние автомата защиты Stripe и счетчики вызовов
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(stripe_breaker.stats())
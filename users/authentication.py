@@ -0,0 +1,188 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework import permissions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import User
+from .tokens import ROLE_CLAIMS
+
+AUTH_CACHE_HITS_KEY = 'users:auth:hits'
+AUTH_CACHE_MISSES_KEY = 'users:auth:misses'
+
+
+def _auth_cache_key(user_id):
+    return f'users:auth:{user_id}'
+
+
+def _increment(key):
+    """
+    Выборочный учет попаданий и промахов: счетчик в Redis стоит лишних обращений,
+    поэтому увеличивается только для доли AUTH_CACHE_STATS_SAMPLE_RATE запросов
+    """
+    if random.random() >= settings.AUTH_CACHE_STATS_SAMPLE_RATE:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Первое значение: add атомарен, параллельный запрос мог успеть создать счетчик
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+# Поля, которые читают аутентификация, проверки прав и профиль /users/me/.
+# Роль модератора кешируется отдельно (users.roles), хеш пароля в общий кеш не попадает
+AUTH_CACHE_FIELDS = (
+    'id', 'email', 'is_active', 'is_staff', 'is_superuser',
+    'first_name', 'last_name', 'phone', 'city', 'avatar', 'date_joined', 'last_login',
+)
+
+
+def serialize_user(user):
+    """
+    Данные пользователя для кеша аутентификации
+    """
+    # Значения в том виде, в каком их хранит база: файл аватара — имя, а не FieldFile
+    data = {field: User._meta.get_field(field).get_prep_value(getattr(user, field)) for field in AUTH_CACHE_FIELDS}
+    if api_settings.CHECK_REVOKE_TOKEN:
+        # Для проверки отзыва токена достаточно производного хеша, как в самом токене
+        data['revoke_hash'] = get_md5_hash_password(user.password)
+    return data
+
+
+def deserialize_user(data):
+    """
+    Восстанавливает пользователя из кеша. Остальные поля отложены
+    и загружаются из базы при первом обращении
+    """
+    # from_db ожидает значения в порядке полей модели
+    field_names = [field.attname for field in User._meta.concrete_fields if field.attname in AUTH_CACHE_FIELDS]
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, [data[name] for name in field_names])
+
+
+def invalidate_auth_cache(user_ids):
+    """
+    Удаляет закешированных пользователей
+    """
+    keys = [_auth_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def auth_cache_stats():
+    """
+    Оценка числа попаданий и промахов кеша аутентификации по выборке
+    """
+    rate = settings.AUTH_CACHE_STATS_SAMPLE_RATE
+    values = cache.get_many([AUTH_CACHE_HITS_KEY, AUTH_CACHE_MISSES_KEY])
+    return {
+        'hits': round(values.get(AUTH_CACHE_HITS_KEY, 0) / rate) if rate else 0,
+        'misses': round(values.get(AUTH_CACHE_MISSES_KEY, 0) / rate) if rate else 0,
+        'sample_rate': rate,
+    }
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация, которая берет пользователя из общего кеша,
+    а в базу обращается только при промахе.
+    Кеш сбрасывается при сохранении и удалении пользователя.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken('Токен не содержит идентификатор пользователя') from e
+
+        key = _auth_cache_key(user_id)
+        values = cache.get(key)
+        # Запись старого формата без части полей считается промахом
+        if values is None or any(field not in values for field in AUTH_CACHE_FIELDS):
+            _increment(AUTH_CACHE_MISSES_KEY)
+            user = super().get_user(validated_token)
+            cache.set(key, serialize_user(user), settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+
+        _increment(AUTH_CACHE_HITS_KEY)
+        user = deserialize_user(values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен', code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != values.get('revoke_hash'):
+                raise AuthenticationFailed('Пароль пользователя был изменен', code='password_changed')
+
+        return user
+
+
+class ClaimsTokenUser(TokenUser):
+    """
+    Легковесный пользователь, построенный из claims access-токена без запроса к базе
+    """
+
+    def __init__(self, token):
+        super().__init__(token)
+        # Роль уже известна из токена, повторная проверка не нужна
+        self._is_moderator = bool(token['is_moderator'])
+
+    @cached_property
+    def id(self):
+        return User._meta.pk.to_python(super().id)
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def is_active(self):
+        return bool(self.token['is_active'])
+
+
+class ClaimsJWTAuthentication(CachedJWTAuthentication):
+    """
+    Для безопасных (читающих) запросов пользователь строится из claims токена,
+    без обращения к таблице пользователей. Claims доверяем не дольше
+    JWT_ROLE_CLAIMS_MAX_AGE с момента выпуска токена, иначе пользователь
+    загружается через кеш как обычно. Изменяющие запросы всегда работают
+    с полноценной моделью пользователя.
+    """
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+
+        if request.method in permissions.SAFE_METHODS and self.has_fresh_claims(validated_token):
+            return self.get_claims_user(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def has_fresh_claims(self, validated_token):
+        if any(claim not in validated_token for claim in ROLE_CLAIMS):
+            return False
+        issued_at = validated_token.get('iat')
+        if issued_at is None:
+            return False
+        age = timezone.now().timestamp() - issued_at
+        return age <= settings.JWT_ROLE_CLAIMS_MAX_AGE.total_seconds()
+
+    def get_claims_user(self, validated_token):
+        user = ClaimsTokenUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed('Пользователь неактивен', code='user_inactive')
+        return user
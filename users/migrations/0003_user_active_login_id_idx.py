@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:28
+
+from django.db import migrations, models
+
+from materials.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0002_payment'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(
+                condition=models.Q(('is_active', True)), fields=['last_login', 'id'], name='users_active_login_id_idx'
+            ),
+        ),
+    ]
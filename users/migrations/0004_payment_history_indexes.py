@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:47
+
+from django.db import migrations, models
+
+from materials.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY не выполняется внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('materials', '0011_payment_history_indexes'),
+        ('users', '0003_user_active_login_id_idx'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['user', '-payment_date', '-id'], name='users_payment_user_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['user', 'payment_method', '-payment_date', '-id'], name='users_payment_user_method_idx'),
+        ),
+    ]
@@ -45,6 +45,12 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            # Поиск давно не заходивших активных пользователей (users.tasks.check_inactive_users):
+            # пачки выбираются по ключу (last_login, id) в порядке этого индекса
+            models.Index(fields=['last_login', 'id'], condition=models.Q(is_active=True),
+                         name='users_active_login_id_idx'),
+        ]
 
     def __str__(self):
         return self.email
@@ -69,6 +75,14 @@ class Payment(models.Model):
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
         ordering = ['-payment_date']
+        indexes = [
+            # История платежей пользователя (users.views.PaymentViewSet)
+            models.Index(fields=['user', '-payment_date', '-id'], name='users_payment_user_date_idx'),
+            # Фильтр по способу оплаты в истории; курс и урок покрыты индексами внешних ключей
+            models.Index(
+                fields=['user', 'payment_method', '-payment_date', '-id'], name='users_payment_user_method_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"Платеж {self.user.email} - {self.amount} руб."
@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from users.roles import is_moderator
+
 
 class IsModerator(permissions.BasePermission):
     """
@@ -9,7 +11,7 @@ class IsModerator(permissions.BasePermission):
 
     def has_permission(self, request, view):
         if request.user.is_authenticated:
-            return request.user.groups.filter(name='moderators').exists()
+            return is_moderator(request.user)
         return False
 
     def has_object_permission(self, request, view, obj):
@@ -24,11 +26,11 @@ class IsOwnerOrModerator(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # Проверяем, является ли пользователь владельцем
-        if hasattr(obj, 'owner') and obj.owner == request.user:
+        if hasattr(obj, 'owner') and obj.owner_id == request.user.pk:
             return True
 
         # Проверяем, является ли пользователь модератором
-        if request.user.groups.filter(name='moderators').exists():
+        if is_moderator(request.user):
             return request.method in permissions.SAFE_METHODS or request.method in ['PUT', 'PATCH']
 
         return False
\ No newline at end of file
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+
+MODERATORS_GROUP = 'moderators'
+
+# Атрибут объекта пользователя, в котором роль запоминается на время запроса
+_REQUEST_ATTR = '_is_moderator'
+
+
+def _role_cache_key(user_id):
+    return f'users:is_moderator:{user_id}'
+
+
+def is_moderator(user):
+    """
+    Проверяет, входит ли пользователь в группу модераторов.
+    Результат запоминается на объекте пользователя (один раз за запрос)
+    и в общем кеше (между запросами и процессами).
+    """
+    if user is None or not user.is_authenticated:
+        return False
+
+    value = getattr(user, _REQUEST_ATTR, None)
+    if value is not None:
+        return value
+
+    key = _role_cache_key(user.pk)
+    value = cache.get(key)
+    if value is None:
+        value = user.groups.filter(name=MODERATORS_GROUP).exists()
+        cache.set(key, value, settings.ROLE_CACHE_TIMEOUT)
+
+    setattr(user, _REQUEST_ATTR, value)
+    return value
+
+
+def invalidate_roles(user_ids):
+    """
+    Сбрасывает закешированные роли указанных пользователей
+    """
+    keys = [_role_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from .models import User, Payment
+from .tokens import RoleRefreshToken
 
 class PaymentSerializer(serializers.ModelSerializer):
     user_email = serializers.EmailField(source='user.email', read_only=True)
@@ -57,3 +59,16 @@ class UserDetailSerializer(serializers.ModelSerializer):
                  'is_staff', 'is_active', 'date_joined', 'last_login']
         read_only_fields = ['id', 'is_staff', 'is_active', 'date_joined', 'last_login']
 
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Выдача пары токенов с claims is_moderator и is_active
+    """
+    token_class = RoleRefreshToken
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление access-токена с перечитыванием роли пользователя из базы
+    """
+    token_class = RoleRefreshToken
@@ -0,0 +1,56 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_auth_cache
+from .models import User
+from .roles import invalidate_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_role_cache_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Сброс кеша ролей при изменении состава групп пользователя
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        if action == 'pre_clear':
+            return
+        instance.__dict__.pop('_is_moderator', None)
+        invalidate_roles([instance.pk])
+    elif action == 'pre_clear':
+        # group.user_set.clear(): после очистки список участников уже не получить
+        invalidate_roles(instance.user_set.values_list('pk', flat=True))
+    elif action != 'post_clear':
+        # group.user_set.add(...) / remove(...)
+        invalidate_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_role_cache_on_group_change(sender, instance, **kwargs):
+    """
+    Сброс кеша ролей участников группы при ее переименовании или удалении
+    """
+    invalidate_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def reset_role_cache_on_user_create(sender, instance, created, **kwargs):
+    """
+    Новый пользователь не должен получить роль из устаревшей записи кеша
+    """
+    if created:
+        invalidate_roles([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache_on_user_change(sender, instance, **kwargs):
+    """
+    Сброс закешированного для аутентификации пользователя
+    """
+    invalidate_auth_cache([instance.pk])
@@ -1,33 +1,84 @@
+import logging
+import time
+
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth import get_user_model
 
+from .authentication import invalidate_auth_cache
+
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+# Прогресс блокировки: порог и ключ (last_login, id) последнего обработанного пользователя.
+# Позволяет продолжить с того же места после перезапуска воркера
+DEACTIVATION_CHECKPOINT_KEY = 'users:deactivation:checkpoint'
+DEACTIVATION_CHECKPOINT_TIMEOUT = 24 * 60 * 60
+
 
 @shared_task
 def check_inactive_users():
     """
-    Проверка и блокировка пользователей, которые не заходили более месяца
+    Проверка и блокировка пользователей, которые не заходили более месяца.
+    Пользователи блокируются пачками по ключу (last_login, id) в коротких транзакциях
     """
     try:
-        # Вычисляем дату, до которой считаем пользователя активным
-        threshold_date = timezone.now() - timedelta(days=30)
+        checkpoint = cache.get(DEACTIVATION_CHECKPOINT_KEY)
+        if checkpoint:
+            # Продолжаем прерванный запуск с тем же порогом
+            threshold_date = checkpoint['threshold_date']
+            last_login, last_pk = checkpoint['last_login'], checkpoint['last_pk']
+        else:
+            # Вычисляем дату, до которой считаем пользователя активным
+            threshold_date = timezone.now() - timedelta(days=30)
+            last_login = last_pk = None
+
+        total = 0
+        batches = 0
+        while True:
+            started = time.monotonic()
+            with transaction.atomic():
+                # Кандидаты выбираются по частичному индексу (last_login, id) WHERE is_active
+                candidates = User.objects.filter(last_login__lt=threshold_date, is_active=True)
+                if last_login is not None:
+                    candidates = candidates.filter(
+                        Q(last_login__gt=last_login) | Q(last_login=last_login, pk__gt=last_pk)
+                    )
+                rows = list(
+                    candidates.order_by('last_login', 'pk').values_list('last_login', 'pk')
+                    [:settings.INACTIVE_USERS_BATCH_SIZE]
+                )
+                if not rows:
+                    break
+                user_ids = [pk for _, pk in rows]
 
-        # Находим пользователей, которые не заходили более месяца
-        inactive_users = User.objects.filter(
-            last_login__lt=threshold_date,
-            is_active=True
-        )
+                # Блокируем пользователей
+                count = User.objects.filter(pk__in=user_ids, is_active=True).update(is_active=False)
 
-        count = inactive_users.count()
+            # update() не вызывает сигналы, поэтому кеш аутентификации сбрасываем явно
+            invalidate_auth_cache(user_ids)
 
-        # Блокируем пользователей
-        inactive_users.update(is_active=False)
+            last_login, last_pk = rows[-1]
+            total += count
+            batches += 1
+            cache.set(
+                DEACTIVATION_CHECKPOINT_KEY,
+                {'threshold_date': threshold_date, 'last_login': last_login, 'last_pk': last_pk},
+                DEACTIVATION_CHECKPOINT_TIMEOUT
+            )
+            logger.info(
+                'Пачка %s (id до %s): заблокировано %s пользователей за %.3f с',
+                batches, last_pk, count, time.monotonic() - started
+            )
 
-        return f"Заблокировано {count} неактивных пользователей"
+        cache.delete(DEACTIVATION_CHECKPOINT_KEY)
+        return f"Заблокировано {total} неактивных пользователей ({batches} пачек)"
 
     except Exception as e:
         return f"Ошибка при блокировке неактивных пользователей: {str(e)}"
-
@@ -1,3 +1,216 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import auth_cache_stats
+from .models import User
+from .roles import is_moderator
+from .tasks import DEACTIVATION_CHECKPOINT_KEY, check_inactive_users
+from .tokens import RoleRefreshToken
+
+
+class ModeratorRoleTestCase(TestCase):
+    """
+    Тесты кеширования роли модератора
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.group, created = Group.objects.get_or_create(name='moderators')
+
+    def test_role_checked_once_per_request(self):
+        """Повторная проверка на том же объекте не обращается к базе"""
+        self.assertFalse(is_moderator(self.user))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_moderator(self.user))
+
+    def test_role_shared_between_requests(self):
+        """Роль берется из общего кеша для нового объекта пользователя"""
+        is_moderator(self.user)
+        fresh_user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(is_moderator(fresh_user))
+
+    def test_cache_invalidated_on_group_add(self):
+        """Добавление в группу сбрасывает кеш"""
+        self.assertFalse(is_moderator(self.user))
+        self.user.groups.add(self.group)
+        self.assertTrue(is_moderator(User.objects.get(pk=self.user.pk)))
+
+    def test_cache_invalidated_on_reverse_changes(self):
+        """Изменения со стороны группы тоже сбрасывают кеш"""
+        self.group.user_set.add(self.user)
+        self.assertTrue(is_moderator(User.objects.get(pk=self.user.pk)))
+        self.group.user_set.clear()
+        self.assertFalse(is_moderator(User.objects.get(pk=self.user.pk)))
+
+
+class RoleClaimsTestCase(APITestCase):
+    """
+    Тесты claims роли в JWT-токенах
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        self.group, created = Group.objects.get_or_create(name='moderators')
+
+    def _obtain_tokens(self):
+        response = self.client.post(
+            reverse('token_obtain_pair'),
+            {'email': 'user@test.com', 'password': 'testpass123'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_access_token_contains_role_claims(self):
+        """Access-токен содержит роль и статус пользователя"""
+        access = AccessToken(self._obtain_tokens()['access'])
+        self.assertFalse(access['is_moderator'])
+        self.assertTrue(access['is_active'])
+
+    def test_refresh_rereads_role(self):
+        """При обновлении токена роль берется из базы"""
+        refresh = self._obtain_tokens()['refresh']
+        self.user.groups.add(self.group)
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(AccessToken(response.data['access'])['is_moderator'])
+
+    def test_read_request_without_user_query(self):
+        """Читающий запрос не загружает пользователя из базы"""
+        access = self._obtain_tokens()['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user_lookup = f'FROM "{User._meta.db_table}" WHERE'
+        self.assertFalse(any(user_lookup in query['sql'] for query in context.captured_queries))
+
+    def test_inactive_claim_rejected(self):
+        """Токен с is_active=False не проходит аутентификацию"""
+        token = RoleRefreshToken.for_user(self.user).access_token
+        token['is_active'] = False
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(reverse('courses-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(AUTH_CACHE_STATS_SAMPLE_RATE=1.0)
+class AuthUserCacheTestCase(APITestCase):
+    """
+    Тесты кеша пользователей для JWT-аутентификации
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='user@test.com', password='testpass123')
+        token = RoleRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def _user_lookups(self):
+        # История платежей не читает полей пользователя, кроме id
+        user_lookup = f'FROM "{User._meta.db_table}" WHERE'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('payment-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sum(user_lookup in query['sql'] for query in context.captured_queries)
+
+    def test_second_request_uses_cache(self):
+        """Повторный запрос берет пользователя из кеша"""
+        self.assertEqual(self._user_lookups(), 1)
+        self.assertEqual(self._user_lookups(), 0)
+        self.assertEqual(auth_cache_stats(), {'hits': 1, 'misses': 1, 'sample_rate': 1.0})
+
+    @override_settings(AUTH_CACHE_STATS_SAMPLE_RATE=0.0)
+    def test_stats_disabled(self):
+        """При нулевой доле выборки счетчики не ведутся"""
+        self._user_lookups()
+        self._user_lookups()
+        self.assertIsNone(cache.get('users:auth:hits'))
+        self.assertIsNone(cache.get('users:auth:misses'))
+
+    def test_password_hash_not_cached(self):
+        """В кеш попадают только поля для аутентификации, без хеша пароля"""
+        self._user_lookups()
+        values = cache.get(f'users:auth:{self.user.pk}')
+        self.assertNotIn('password', values)
+        self.assertNotIn(self.user.password, values.values())
+        self.assertEqual(values['email'], 'user@test.com')
+
+    def test_cache_invalidated_on_save(self):
+        """Изменение пользователя сбрасывает кеш"""
+        self._user_lookups()
+        self.user.city = 'Москва'
+        self.user.save()
+        self.assertEqual(self._user_lookups(), 1)
+        response = self.client.get(reverse('users-me'))
+        self.assertEqual(response.data['city'], 'Москва')
+
+    def test_me_served_from_cache(self):
+        """Профиль /users/me/ при попадании в кеш отдается без запросов к базе"""
+        self.user.city = 'Москва'
+        self.user.save()
+        self.client.get(reverse('users-me'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('users-me'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'user@test.com')
+        self.assertEqual(response.data['city'], 'Москва')
+        self.assertIsNone(response.data['avatar'])
+        self.assertNotIn('password', cache.get(f'users:auth:{self.user.pk}'))
+
+    def test_deactivated_user_rejected(self):
+        """Пользователь, заблокированный задачей, не проходит аутентификацию из кеша"""
+        self._user_lookups()
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now() - timedelta(days=31))
+        check_inactive_users()
+        response = self.client.get(reverse('users-me'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class InactiveUsersTestCase(TestCase):
+    """
+    Тесты пакетной блокировки неактивных пользователей
+    """
+
+    def setUp(self):
+        cache.clear()
+        old_login = timezone.now() - timedelta(days=60)
+        for i in range(5):
+            User.objects.create_user(email=f'inactive{i}@test.com', password='testpass123', last_login=old_login)
+        self.active_user = User.objects.create_user(
+            email='active@test.com', password='testpass123', last_login=timezone.now()
+        )
+
+    @override_settings(INACTIVE_USERS_BATCH_SIZE=2)
+    def test_deactivated_in_batches(self):
+        """Неактивные пользователи блокируются пачками"""
+        result = check_inactive_users()
+        self.assertIn('Заблокировано 5', result)
+        self.assertIn('3 пачек', result)
+        self.assertEqual(User.objects.filter(is_active=True).count(), 1)
+        self.assertIsNone(cache.get(DEACTIVATION_CHECKPOINT_KEY))
+
+    def test_resumes_from_checkpoint(self):
+        """Прерванный запуск продолжается с сохраненного ключа (last_login, id)"""
+        inactive = list(User.objects.filter(email__startswith='inactive').order_by('last_login', 'pk'))
+        cache.set(DEACTIVATION_CHECKPOINT_KEY, {
+            'threshold_date': timezone.now() - timedelta(days=30),
+            'last_login': inactive[2].last_login,
+            'last_pk': inactive[2].pk,
+        })
+        result = check_inactive_users()
+        self.assertIn('Заблокировано 2', result)
+        self.assertTrue(User.objects.get(pk=inactive[0].pk).is_active)
+        self.assertFalse(User.objects.get(pk=inactive[4].pk).is_active)
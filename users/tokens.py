@@ -0,0 +1,45 @@
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .roles import is_moderator
+
+# Claims с ролью и статусом пользователя, которые встраиваются в access-токен
+ROLE_CLAIMS = ('is_moderator', 'is_active')
+
+
+def set_role_claims(token, user):
+    """
+    Записывает в токен актуальные роль и статус пользователя
+    """
+    token['is_moderator'] = is_moderator(user)
+    token['is_active'] = user.is_active
+
+
+class RoleRefreshToken(RefreshToken):
+    """
+    Refresh-токен, который при каждом выпуске access-токена заново читает
+    роль пользователя из базы. Поэтому claims в access-токене устаревают
+    не дольше, чем на ACCESS_TOKEN_LIFETIME.
+    """
+    no_copy_claims = RefreshToken.no_copy_claims + ROLE_CLAIMS
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        # Пользователь уже загружен при входе, повторно его не запрашиваем
+        token._user = user
+        return token
+
+    @property
+    def access_token(self):
+        from .models import User
+
+        access = super().access_token
+        user = getattr(self, '_user', None)
+        if user is None:
+            user = User.objects.filter(
+                **{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]}
+            ).first()
+        if user is not None:
+            set_role_claims(access, user)
+        return access
@@ -3,6 +3,9 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
+
+from materials.paginators import PaymentPagination
+from .authentication import auth_cache_stats
 from .models import Payment, User
 from .serializers import PaymentSerializer, UserSerializer, UserRegistrationSerializer, UserDetailSerializer
 
@@ -21,13 +24,28 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.action == 'create':
             return [permissions.AllowAny()]
+        if self.action == 'auth_cache_stats':
+            return [permissions.IsAdminUser()]
         return [permissions.IsAuthenticated()]
 
     @action(detail=False, methods=['get'])
     def me(self, request):
-        serializer = UserDetailSerializer(request.user)
+        user = request.user
+        # Пользователь из кеша аутентификации уже содержит поля профиля,
+        # догружаются только те, что кеш не покрывает
+        deferred = user.get_deferred_fields() & set(UserDetailSerializer.Meta.fields)
+        if deferred:
+            user.refresh_from_db(fields=deferred)
+        serializer = UserDetailSerializer(user)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='auth-cache-stats')
+    def auth_cache_stats(self, request):
+        """
+        Счетчики попаданий и промахов кеша аутентификации
+        """
+        return Response(auth_cache_stats())
+
 
 class PaymentViewSet(viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
@@ -35,7 +53,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, OrderingFilter]  # Теперь это будет работать
     filterset_fields = ['paid_course', 'paid_lesson', 'payment_method']
     ordering_fields = ['payment_date']
+    pagination_class = PaymentPagination
 
     def get_queryset(self):
-        return Payment.objects.filter(user=self.request.user)
+        return Payment.objects.filter(user=self.request.user).select_related('user', 'paid_course', 'paid_lesson')
 